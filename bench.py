@@ -0,0 +1,335 @@
+# encoding: utf-8
+from __future__ import absolute_import, print_function, unicode_literals
+
+import logging
+import sys
+import time
+import tracemalloc
+from copy import deepcopy
+from io import BytesIO
+
+from docx import Document
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+
+import docx_ext
+from docx_ext.parser import Context, gen_tree
+
+
+# patch docx library
+docx_ext.init()
+
+log = logging.getLogger(__name__)
+
+__author__ = 'bluec0re'
+
+
+def bench_memory(path='HelloField.docx', clones=1000):
+    """
+    Memory used by the evaluation nodes when the parsed tree is cloned like
+    ForEach does it for every iteration.
+    """
+    tree = gen_tree(Document(path))
+
+    tracemalloc.start()
+    before = tracemalloc.take_snapshot()
+    copies = [deepcopy(child) for _ in range(clones) for child in tree.childs]
+    after = tracemalloc.take_snapshot()
+    tracemalloc.stop()
+
+    size = sum(stat.size_diff for stat in after.compare_to(before, 'filename'))
+    print('memory: %d nodes, %d bytes total, %.1f bytes/node' % (
+        len(copies), size, float(size) / max(len(copies), 1)))
+
+
+# noinspection PyProtectedMember
+def add_field(paragraph, instr):
+    def run(child):
+        r = OxmlElement('w:r')
+        r.append(child)
+        paragraph._p.append(r)
+
+    instr_text = OxmlElement('w:instrText')
+    instr_text.text = instr
+    default = OxmlElement('w:t')
+    default.text = '\u00AB%s\u00BB' % instr
+    run(OxmlElement('w:fldChar', attrs={qn('w:fldCharType'): 'begin'}))
+    run(instr_text)
+    run(OxmlElement('w:fldChar', attrs={qn('w:fldCharType'): 'separate'}))
+    run(default)
+    run(OxmlElement('w:fldChar', attrs={qn('w:fldCharType'): 'end'}))
+
+
+def loop_template(columns=4, rows=False):
+    """
+    Template with one loop over $rows, either as table rows or paragraphs.
+    """
+    doc = Document()
+    foreach = ' MERGEFIELD "#foreach($row in $rows)" '
+    if rows:
+        table = doc.add_table(rows=3, cols=columns, style=None)
+        add_field(table.rows[0].cells[0].paragraphs[0], foreach)
+        for i in range(columns):
+            add_field(table.rows[1].cells[i].paragraphs[0], ' MERGEFIELD $row.c%d ' % i)
+        add_field(table.rows[2].cells[0].paragraphs[0], ' MERGEFIELD #end ')
+    else:
+        add_field(doc.add_paragraph(), foreach)
+        for i in range(columns):
+            add_field(doc.add_paragraph(), ' MERGEFIELD $row.c%d ' % i)
+        add_field(doc.add_paragraph(), ' MERGEFIELD #end ')
+        doc.add_paragraph()
+
+    io = BytesIO()
+    doc.save(io)
+    return io
+
+
+def bench_rows(items=2000, columns=4):
+    """
+    Row repeat of a table loop against the generic loop over paragraphs with
+    the same number of variables.
+    """
+    context = {'rows': [{'c%d' % i: 'value %d' % n for i in range(columns)} for n in range(items)]}
+    for name, rows in (('generic', False), ('rows', True)):
+        doc = Document(loop_template(columns, rows))
+        start = time.time()
+        gen_tree(doc).evaluate(Context(context))
+        print('rows: %-7s %d items in %.2fs' % (name, items, time.time() - start))
+
+
+# noinspection PyProtectedMember
+def bench_save(images=20, runs=5):
+    """
+    Saving a rendered image heavy template, rewriting all parts like
+    python-docx against copying the unchanged ones.
+    """
+    from PIL import Image
+
+    lena = Image.open('lena.png')
+    doc = Document()
+    for i in range(images):
+        # identical images would share one part
+        image = BytesIO()
+        lena.rotate(i * 90.0 / images).save(image, 'PNG')
+        doc.add_picture(image)
+    template = BytesIO()
+    doc._package.save(template)
+
+    doc = Document(template)
+    doc.add_paragraph('rendered')
+    for name, save in (('rewrite', doc._package.save), ('copy', doc.save)):
+        start = time.time()
+        for _ in range(runs):
+            save(BytesIO())
+        print('save: %-7s %.1fms' % (name, (time.time() - start) * 1000 / runs))
+
+
+def bench_compress(images=8, paragraphs=20000):
+    """
+    Saving a large rendered document with new images by compression level
+    and number of compressing threads.
+    """
+    from PIL import Image
+
+    lena = Image.open('lena.png')
+    doc = Document()
+    for i in range(paragraphs):
+        doc.add_paragraph('paragraph %d of the rendered document' % i)
+    for i in range(images):
+        image = BytesIO()
+        lena.rotate(i * 90.0 / images).save(image, 'PNG')
+        doc.add_picture(image)
+
+    for level, workers in ((None, 1), (None, 4), (1, 4), (0, 1)):
+        out = BytesIO()
+        start = time.time()
+        doc.save(out, level=level, workers=workers)
+        print('compress: level %-4s %d threads %.1fms %d bytes' % (
+            level, workers, (time.time() - start) * 1000, len(out.getvalue())))
+
+
+def bench_shard(items=20000, columns=4, chunk_size=2000):
+    """
+    Paragraph loop rendered with the streaming loop in one process against
+    sharded over worker processes.
+    """
+    from docx_ext.shard import render_sharded
+    from docx_ext.stream import save_streaming
+
+    context = {'rows': [{'c%d' % i: 'value %d' % n for i in range(columns)} for n in range(items)]}
+    template = loop_template(columns)
+    for name, render in (('single', save_streaming),
+                         ('sharded', lambda *args: render_sharded(*args, chunk_size=chunk_size))):
+        start = time.time()
+        render(Document(template), context, BytesIO())
+        print('shard: %-7s %d items in %.2fs' % (name, items, time.time() - start))
+
+
+def bench_specialize(documents=20):
+    """
+    Batch of documents sharing the author and logo of the demo template,
+    rendered from the template against a template specialized for them.
+    """
+    from PIL import Image
+    from docx_ext.render import render
+    from docx_ext.specialize import SpecializedTemplate
+
+    logo = Image.open('lena.png')
+    logo.caption = 'Great picture'
+    constants = {'author': 'Me, who else?', 'logo': logo}
+    contexts = [{'items': [{'name': 'Item %d' % n, 'description': 'Document %d' % n}]}
+                for n in range(documents)]
+
+    start = time.time()
+    for context in contexts:
+        variables = dict(constants)
+        variables.update(context)
+        render('HelloField.docx', variables, BytesIO())
+    print('specialize: plain       %d documents in %.2fs' % (documents, time.time() - start))
+
+    start = time.time()
+    template = SpecializedTemplate('HelloField.docx', constants)
+    for context in contexts:
+        template.render(context, BytesIO())
+    print('specialize: specialized %d documents in %.2fs' % (documents, time.time() - start))
+
+
+# noinspection PyProtectedMember
+def fragmented_template(columns=4, fragments=20):
+    """
+    Paragraph loop template whose text is split over many runs with proofing
+    marks and revision ids, like Word saves edited documents.
+    """
+    doc = Document(loop_template(columns))
+    for paragraph in doc.paragraphs:
+        for n in range(fragments):
+            if n % 4 == 0:
+                paragraph._p.append(OxmlElement('w:proofErr', attrs={qn('w:type'): 'spellStart'}))
+            r = OxmlElement('w:r', attrs={qn('w:rsidR'): '00%06X' % n})
+            t = OxmlElement('w:t')
+            t.text = 'word%d ' % n
+            t.set('{http://www.w3.org/XML/1998/namespace}space', 'preserve')
+            r.append(t)
+            paragraph._p.append(r)
+
+    io = BytesIO()
+    doc.save(io)
+    return io
+
+
+def bench_normalize(items=1000, columns=4, fragments=20):
+    """
+    Paragraph loop over a fragmented template, with and without merging the
+    runs first.
+    """
+    from docx_ext.normalize import normalize
+
+    template = fragmented_template(columns, fragments)
+    # noinspection PyProtectedMember
+    before, after = normalize(deepcopy(Document(template)._document_part._element.body))
+    print('normalize: %d nodes in the body, %d after normalizing' % (before, after))
+
+    context = {'rows': [{'c%d' % i: 'value %d' % n for i in range(columns)} for n in range(items)]}
+    for enabled in (False, True):
+        doc = Document(template)
+        start = time.time()
+        gen_tree(doc, normalize=enabled).evaluate(Context(context))
+        print('normalize: %-8s %d items in %.2fs' % ('on' if enabled else 'off', items, time.time() - start))
+
+
+def bench_schema(items=20000, unused=20):
+    """
+    JSON serialization of a context with unused columns, as it is and reduced
+    to the schema of the demo template.
+    """
+    import json
+    from docx_ext.schema import analyze
+
+    schema = analyze(gen_tree(Document('HelloField.docx')))
+    item = {'name': 'name', 'description': 'description'}
+    item.update(('extra%d' % i, 'unused value %d' % i) for i in range(unused))
+    context = {'author': 'Me', 'items': [dict(item) for _ in range(items)], 'audit': ['entry'] * items}
+
+    start = time.time()
+    size = len(json.dumps(context))
+    print('schema: full    %d bytes in %.2fs' % (size, time.time() - start))
+
+    start = time.time()
+    size = len(json.dumps(schema.prune(context)))
+    print('schema: pruned  %d bytes in %.2fs (paths %s)' % (size, time.time() - start, ', '.join(schema.paths())))
+
+
+def bench_stages(items=300):
+    """
+    Memory per render stage of the demo template with HTML descriptions and
+    images.
+    """
+    from PIL import Image
+    from docx_ext.memory import MemoryProfile
+    from docx_ext.render import render
+
+    logo = Image.open('lena.png')
+    logo.caption = 'Great picture'
+    description = '<p>Item with <b>bold</b> and <span style="color: #00ff00">green</span> text</p>' * 5
+    context = {'author': 'Me', 'logo': logo,
+               'items': [{'name': 'Item %d' % n, 'description': description} for n in range(items)]}
+
+    with MemoryProfile() as profile:
+        render('HelloField.docx', context, BytesIO())
+    print('stages:\n' + profile.report())
+
+
+def bench_pool(documents=50):
+    """
+    Opening and rendering the demo template from its file against copies of
+    the pooled template.
+    """
+    from docx_ext.pool import TemplatePool
+    from docx_ext.render import render
+
+    pool = TemplatePool()
+    pool.get('HelloField.docx')
+    context = {'author': 'Me', 'items': [{'name': 'Item', 'description': 'Description'}]}
+
+    for name, open_template in (('file', Document), ('pool', pool.get)):
+        start = time.time()
+        for _ in range(documents):
+            open_template('HelloField.docx')
+        opened = (time.time() - start) / documents
+
+        start = time.time()
+        for _ in range(documents):
+            render(open_template('HelloField.docx'), dict(context), BytesIO())
+        print('pool: %-4s open %.2fms, render %.2fms' % (
+            name, opened * 1000, (time.time() - start) / documents * 1000))
+
+    start = time.time()
+    for _ in range(documents):
+        doc, tree = pool.get_tree('HelloField.docx')
+        render(doc, dict(context), BytesIO(), tree=tree)
+    print('pool: tree render %.2fms' % ((time.time() - start) / documents * 1000))
+
+
+BENCHMARKS = {
+    'compress': bench_compress,
+    'memory': bench_memory,
+    'normalize': bench_normalize,
+    'pool': bench_pool,
+    'rows': bench_rows,
+    'save': bench_save,
+    'schema': bench_schema,
+    'shard': bench_shard,
+    'specialize': bench_specialize,
+    'stages': bench_stages,
+}
+
+
+def main():
+    names = sys.argv[1:] or sorted(BENCHMARKS)
+    for name in names:
+        BENCHMARKS[name]()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level='WARNING', format='%(levelname)s-%(module)s.%(funcName)s:%(lineno)d: %(message)s')
+    main()
@@ -1,18 +1,51 @@
 # encoding: utf-8
 from __future__ import absolute_import, unicode_literals
 
+import threading
+
 
 __author__ = 'bluec0re'
 
 __version__ = '0.1'
 
-from .fields import Field, register_image_factory, unregister_image_factory
+# python-docx is only imported once a feature needs it, the patches are
+# applied by init(); these names are looked up lazily
+_LAZY = {
+    'Field': 'fields',
+    'Session': 'session',
+    'register_image_factory': 'fields',
+    'unregister_image_factory': 'fields',
+}
 
-# noinspection PyUnresolvedReferences
-from . import document
-from . import paragraph
-from . import runs
+_initialized = False
+_init_lock = threading.Lock()
 
 
 def init():
-    pass
+    """
+    Patch the docx library. Element classes are registered here as well, so
+    call this before documents are loaded.
+    """
+    global _initialized
+    if _initialized:
+        return
+
+    # renders started in parallel threads must not see half applied patches
+    with _init_lock:
+        if _initialized:
+            return
+        from . import document
+        from . import fields
+        from . import paragraph
+        from . import runs
+        _initialized = True
+
+
+def __getattr__(name):
+    if name not in _LAZY:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+    from importlib import import_module
+    value = getattr(import_module('.' + _LAZY[name], __name__), name)
+    globals()[name] = value
+    return value
@@ -0,0 +1,93 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+import asyncio
+import logging
+import re
+from functools import partial
+
+from .render import render
+
+
+__author__ = 'bluec0re'
+
+log = logging.getLogger(__name__)
+
+
+IMG_SRC = re.compile(r'<img\s[^>]*?src\s*=\s*"?([^" >]+)', re.I)
+
+
+def image_sources(context):
+    """
+    >>> sorted(image_sources({'a': ['<p><img src="lena.png"></p>', 'b'], 'c': '<img alt="x" src=x.png />'}))
+    ['lena.png', 'x.png']
+    """
+    from .parser import Context
+
+    if isinstance(context, Context):
+        context = context.variables
+
+    sources = set()
+    if isinstance(context, dict):
+        for value in context.values():
+            sources |= image_sources(value)
+    elif isinstance(context, (list, tuple)):
+        for value in context:
+            sources |= image_sources(value)
+    elif isinstance(context, str):
+        sources.update(IMG_SRC.findall(context))
+    return sources
+
+
+class AsyncRenderer(object):
+    """
+    Renders documents without blocking the event loop. Template loading, tree
+    evaluation and saving run in *executor* (the loop's default executor if
+    None), images referenced by HTML values are fetched concurrently through
+    the async *image_factories* beforehand. At most *max_concurrent* renders
+    run at the same time, further calls wait.
+    """
+
+    def __init__(self, executor=None, image_factories=(), max_concurrent=4):
+        self.executor = executor
+        self.image_factories = list(image_factories)
+        self.max_concurrent = max_concurrent
+        self._semaphore = None
+
+    async def fetch_image(self, src):
+        for factory in self.image_factories:
+            img = await factory(src)
+            if img is not None:
+                return img
+
+    async def fetch_images(self, context):
+        sources = sorted(image_sources(context))
+        if not sources or not self.image_factories:
+            return {}
+        images = await asyncio.gather(*[self.fetch_image(src) for src in sources])
+        log.debug("Fetched %d images", len(sources))
+        return {src: img for src, img in zip(sources, images) if img is not None}
+
+    async def render(self, template, context, target, allowed_styles=None):
+        if self._semaphore is None and self.max_concurrent:
+            self._semaphore = asyncio.Semaphore(self.max_concurrent)
+
+        if self._semaphore is None:
+            return await self._render(template, context, target, allowed_styles)
+        async with self._semaphore:
+            return await self._render(template, context, target, allowed_styles)
+
+    async def _render(self, template, context, target, allowed_styles):
+        from .fields import registered_image_factories
+        from .session import Session
+
+        images = await self.fetch_images(context)
+
+        def prefetched(path):
+            return images.get(path)
+
+        # only this render looks up the prefetched images
+        session = Session(registered_image_factories() + (prefetched,))
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(self.executor, partial(render, template, context, target,
+                                                          allowed_styles=allowed_styles, session=session))
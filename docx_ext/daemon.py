@@ -0,0 +1,214 @@
+# encoding: utf-8
+"""
+Render daemon keeping templates warm between renders.
+
+    python -m docx_ext.daemon --port 8765 --workers 4 --templates templates/ --output out/
+
+``POST /render`` takes a JSON object (as ``application/json``) with
+``template``, ``context`` and ``target`` paths, ``GET /metrics`` reports
+queue depth and latencies. The paths are relative to the template and
+output directories, paths outside of them are rejected.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from .render import render
+
+
+__author__ = 'bluec0re'
+
+log = logging.getLogger(__name__)
+
+
+# one pool per worker process, created on its first render
+_TEMPLATES = None
+
+
+def _render(template, context, target):
+    global _TEMPLATES
+    if _TEMPLATES is None:
+        from .pool import TemplatePool
+        _TEMPLATES = TemplatePool()
+
+    start = time.time()
+    # the copy comes with its evaluation tree, the template is only
+    # scanned for fields when it is loaded
+    doc, tree = _TEMPLATES.get_tree(template)
+    render(doc, context, target, tree=tree)
+    return time.time() - start
+
+
+def resolve(root, path):
+    """
+    Absolute *path* relative to the directory *root*, links resolved.
+    Raises PermissionError for paths outside of it.
+
+    >>> resolve('/srv/templates', 'a/b.docx')
+    '/srv/templates/a/b.docx'
+    >>> resolve('/srv/templates', '../etc/passwd')
+    Traceback (most recent call last):
+    ...
+    PermissionError: ../etc/passwd is outside of /srv/templates
+    """
+    root = os.path.realpath(root)
+    result = os.path.realpath(os.path.join(root, path))
+    if os.path.commonpath([root, result]) != root:
+        raise PermissionError('%s is outside of %s' % (path, root))
+    return result
+
+
+class Metrics(object):
+    def __init__(self, workers, samples=1000):
+        self.workers = workers
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.latencies = deque(maxlen=samples)
+        self._lock = threading.Lock()
+
+    def started(self):
+        with self._lock:
+            self.in_flight += 1
+
+    def finished(self, latency=None):
+        with self._lock:
+            self.in_flight -= 1
+            if latency is None:
+                self.failed += 1
+            else:
+                self.completed += 1
+                self.latencies.append(latency)
+
+    def snapshot(self):
+        with self._lock:
+            latencies = sorted(self.latencies)
+            result = {
+                'workers': self.workers,
+                'in_flight': self.in_flight,
+                'queue_depth': max(0, self.in_flight - self.workers),
+                'completed': self.completed,
+                'failed': self.failed,
+            }
+        if latencies:
+            result['latency'] = {
+                'mean': sum(latencies) / len(latencies),
+                'p50': latencies[len(latencies) // 2],
+                'p95': latencies[int(len(latencies) * 0.95)],
+                'max': latencies[-1],
+            }
+        return result
+
+
+class RenderDaemon(object):
+    """
+    Serves renders of the templates below *templates* into files below
+    *output* (both default to the working directory).
+    """
+
+    def __init__(self, host='127.0.0.1', port=8765, workers=None, templates='.', output='.'):
+        workers = workers or os.cpu_count() or 1
+        self.templates = templates
+        self.output = output
+        # forked workers would inherit the listening socket
+        self.pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self.metrics = Metrics(workers)
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+
+    def render(self, template, context, target):
+        """
+        Render in a worker process, blocking until it is done. Returns the
+        time spent in the worker.
+        """
+        template = resolve(self.templates, template)
+        target = resolve(self.output, target)
+        self.metrics.started()
+        latency = None
+        try:
+            latency = self.pool.submit(_render, template, context, target).result()
+            return latency
+        finally:
+            self.metrics.finished(latency)
+
+    def _handler(self):
+        daemon = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def _reply(self, status, data):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_GET(self):
+                if self.path == '/metrics':
+                    self._reply(200, daemon.metrics.snapshot())
+                else:
+                    self._reply(404, {'error': 'not found'})
+
+            def do_POST(self):
+                if self.path != '/render':
+                    self._reply(404, {'error': 'not found'})
+                    return
+
+                # no simple cross-site request from a browser has this type
+                if self.headers.get('Content-Type', '').split(';')[0].strip() != 'application/json':
+                    self._reply(415, {'error': 'expected application/json'})
+                    return
+
+                try:
+                    request = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                    seconds = daemon.render(request['template'], request['context'], request['target'])
+                except PermissionError as e:
+                    log.warning("Rejected render: %s", e)
+                    self._reply(403, {'error': str(e)})
+                except Exception as e:
+                    log.exception("Render failed")
+                    self._reply(500, {'error': str(e)})
+                else:
+                    self._reply(200, {'target': request['target'], 'seconds': seconds})
+
+            def log_message(self, fmt, *args):
+                log.debug(fmt, *args)
+
+        return Handler
+
+    def serve_forever(self):
+        log.info("Listening on %s:%d", *self.server.server_address[:2])
+        try:
+            self.server.serve_forever()
+        finally:
+            self.server.server_close()
+            self.pool.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split('\n')[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--templates', default='.', help='directory of the templates')
+    parser.add_argument('--output', default='.', help='directory of the rendered documents')
+    args = parser.parse_args()
+
+    # shut the worker pool down on termination as well
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    RenderDaemon(args.host, args.port, args.workers, args.templates, args.output).serve_forever()
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level='INFO', format='%(levelname)s-%(module)s.%(funcName)s:%(lineno)d: %(message)s')
+    main()
@@ -1,8 +1,12 @@
 # encoding: utf-8
 from __future__ import absolute_import, unicode_literals
 from docx import Document
+from docx.api import _default_docx_path
 from docx.parts.document import DocumentPart
 from docx.oxml.ns import qn
+from docx.table import Table
+from docx.text import Paragraph
+from docx_ext.package import save
 from docx_ext.textbox import Textbox
 
 
@@ -21,16 +25,94 @@ def _styles(self):
 Document.styles = property(_styles)
 
 
+class StoryIndex(object):
+    """
+    Index of all content stories (body paragraphs, tables and textboxes) of a
+    document part, or of the given body level elements only. Textboxes inside
+    ``mc:AlternateContent`` appear twice (choice and fallback) and both are
+    indexed, as both have to be rendered.
+    """
+    # noinspection PyProtectedMember
+    def __init__(self, part, elements=None):
+        body = part.body
+        if elements is None:
+            self.paragraphs = body.paragraphs
+            self.tables = body.tables
+            elements = [part._element.body]
+        else:
+            self.paragraphs = [Paragraph(el, body) for el in elements if el.tag == qn('w:p')]
+            self.tables = [Table(el, body) for el in elements if el.tag == qn('w:tbl')]
+        self.textboxes = [Textbox(parent=part, element=tb)
+                          for el in elements for tb in el.iter(qn('w:txbxContent'))]
+
+    def fields(self):
+        fields = []
+        for paragraph in self.paragraphs:
+            fields += paragraph.fields()
+
+        for table in self.tables:
+            fields += table.fields()
+
+        for textbox in self.textboxes:
+            fields += textbox.fields()
+        return fields
+
+
+def _stories(self):
+    if getattr(self, '_stories', None) is None:
+        self._stories = StoryIndex(self)
+    return self._stories
+
+DocumentPart.stories = property(_stories)
+
+
+def _invalidate_stories(self):
+    self._stories = None
+
+DocumentPart.invalidate_stories = _invalidate_stories
+
+
 def _textboxes(self):
-    tboxes = []
-    for tb in self._element.body.xpath('//w:txbxContent'):
-        tboxes.append(Textbox(parent=self, element=tb))
-    return tboxes
+    return self.stories.textboxes
 
 DocumentPart.textboxes = property(_textboxes)
 
 
+# noinspection PyProtectedMember
+def _stories(self):
+    return self._document_part.stories
+
+Document.stories = property(_stories)
+
+
+# noinspection PyProtectedMember
+def _invalidate_stories(self):
+    self._document_part.invalidate_stories()
+
+Document.invalidate_stories = _invalidate_stories
+
+
 def _textboxes(self):
     return self._document_part.textboxes
 
 Document.textboxes = property(_textboxes)
+
+
+_document_init = Document.__init__
+
+
+def _init(self, docx=None):
+    _document_init(self, docx)
+    # unchanged parts are copied from here when saving
+    self._source = _default_docx_path if docx is None else docx
+
+Document.__init__ = _init
+
+
+def _save(self, path_or_stream, level=None, workers=None):
+    """
+    Compression *level* 0 stores changed parts, which is fastest.
+    """
+    save(self, path_or_stream, level, workers)
+
+Document.save = _save
@@ -1,31 +1,23 @@
 # encoding: utf-8
 from __future__ import absolute_import, unicode_literals
 
-from collections import defaultdict
 from functools import partial
 from io import BytesIO
 import shlex
 import logging
 import re
+import sys
+import threading
 
 from docx.oxml.ns import qn
-from docx.shared import Parented
 from docx.table import Table
 from docx.text import Paragraph, Run
 from lxml.etree import QName
-import lxml.html
+from docx_ext.memory import stage
 from docx_ext.parser import ParserException
 from docx_ext.textbox import Textbox
 
 
-try:
-    from PIL.Image import Image
-except ImportError:
-    Image = None
-
-from .utils import make_abs, make_relative
-
-
 ALLOWED_TAGS = (
     'p',
     'span',
@@ -139,7 +131,15 @@ def clean_html(html):
     return html
 
 
-_IMAGE_FACTORIES = set([])
+# replaced, never changed in place, so sessions can take a snapshot
+_IMAGE_FACTORIES = ()
+_IMAGE_FACTORIES_LOCK = threading.Lock()
+
+
+def is_image(obj):
+    # without PIL being imported, nothing can be an image
+    module = sys.modules.get('PIL.Image')
+    return module is not None and isinstance(obj, module.Image)
 
 
 def image_factory(path):
@@ -149,24 +149,65 @@ def image_factory(path):
             return img
 
 
+def registered_image_factories():
+    return _IMAGE_FACTORIES
+
+
 def register_image_factory(factory):
     global _IMAGE_FACTORIES
-    _IMAGE_FACTORIES.add(factory)
+    with _IMAGE_FACTORIES_LOCK:
+        if factory not in _IMAGE_FACTORIES:
+            _IMAGE_FACTORIES += (factory,)
 
 
 def unregister_image_factory(factory):
     global _IMAGE_FACTORIES
-    _IMAGE_FACTORIES.erase(factory)
+    with _IMAGE_FACTORIES_LOCK:
+        _IMAGE_FACTORIES = tuple(f for f in _IMAGE_FACTORIES if f != factory)
 
 
-# noinspection PyProtectedMember
-class Field(Parented):
-    def __init__(self, parent, code=None, default=None):
-        super(Field, self).__init__(parent)
+class Instruction(object):
+    """
+    Parsed field instruction. It is immutable after parsing and shared between
+    all clones of a field.
+    """
+    __slots__ = ('code', 'default', 'format', 'extra')
+
+    def __init__(self, code=None, default=None):
         self.code = code
         self.default = default
-        self.format = defaultdict(list)
+        self.format = {}
         self.extra = []
+
+    @classmethod
+    def parse(cls, text, default=None):
+        lex = shlex.shlex(text, posix=True)
+        lex.whitespace_split = True
+        lex.commenters = ''
+        lex.escape = ''
+        tokens = list(lex)
+
+        instruction = cls(tokens[0], default)
+        fmt_target = None
+        for token in tokens[1:]:
+            if fmt_target is not None:
+                instruction.format.setdefault(fmt_target, []).append(token)
+                fmt_target = None
+            elif token.startswith('\\'):
+                fmt_target = token[1:]
+            else:
+                instruction.extra.append(token)
+        return instruction
+
+
+# noinspection PyProtectedMember
+class Field(object):
+    __slots__ = ('_parent', 'instruction', 'paragraph', '__xpath_start', '__xpath_end',
+                 '__start', '__end', '_base')
+
+    def __init__(self, parent, code=None, default=None, instruction=None):
+        self._parent = parent
+        self.instruction = instruction or Instruction(code, default)
         self.__xpath_start = None
         self.__xpath_end = None
         self.paragraph = None
@@ -174,6 +215,53 @@ class Field(Parented):
         self.__end = None
         self._base = None
 
+    def __deepcopy__(self, memo):
+        # the instruction and the python-docx parent are shared, only the
+        # anchors are per clone; elements are re-resolved from the xpaths
+        clone = Field(self._parent, instruction=self.instruction)
+        clone.__xpath_start = self.__xpath_start
+        clone.__xpath_end = self.__xpath_end
+        clone.paragraph = self.paragraph
+        clone._base = self._base
+        memo[id(self)] = clone
+        return clone
+
+    def bind(self, start, end, parent=None):
+        """
+        Clone of this field anchored at the given elements.
+        """
+        clone = Field(parent if parent is not None else self._parent, instruction=self.instruction)
+        clone.__start = start
+        clone.__end = end
+        return clone
+
+    def anchor(self, start, end):
+        """
+        Anchor this field at the given elements, keeping its parent.
+        """
+        self.__start = start
+        self.__end = end
+
+    @property
+    def part(self):
+        return self._parent.part
+
+    @property
+    def code(self):
+        return self.instruction.code
+
+    @property
+    def default(self):
+        return self.instruction.default
+
+    @property
+    def format(self):
+        return self.instruction.format
+
+    @property
+    def extra(self):
+        return self.instruction.extra
+
     def __unicode__(self):
         if self.default:
             return "%s (%s)" % (self.code, self.default)
@@ -229,10 +317,6 @@ class Field(Parented):
                 self.__start = base.xpath(self.xpath_start)[0]
             except IndexError:
                 log.warning("Couldn't find start: %s", self.xpath_start)
-
-        if self.__start is not None and self.__end is not None and \
-           self.__start.getparent() == self.__end.getparent():
-            self._parent._p = self.__start.getparent()
         return self.__start
 
     @start.setter
@@ -250,10 +334,6 @@ class Field(Parented):
                 self.__end = base.xpath(self.xpath_end)[0]
             except IndexError:
                 log.warning("Couldn't find end: %s", self.xpath_end)
-
-        if self.__start is not None and self.__end is not None and \
-           self.__start.getparent() == self.__end.getparent():
-            self._parent._p = self.__start.getparent()
         return self.__end
 
     @end.setter
@@ -262,121 +342,141 @@ class Field(Parented):
         if value is not None:
             self.__xpath_end = self.__end.getroottree().getpath(value)
 
-    def insert(self, run, obj, allowed_styles=None):
+    def insert(self, run, obj, allowed_styles=None, session=None):
         if obj is None:
             return
 
-        if Image is not None and isinstance(obj, Image):
-            io = BytesIO()
-            obj.save(io, 'PNG')
-            doc = run._parent._parent._parent
-            # TODO: verify correctness
-            section = doc.sections[-1]
-            width = section.page_width - section.left_margin - section.right_margin
-            run.add_picture(io, width=width)
+        if is_image(obj):
+            with stage('image'):
+                io = session.png(obj) if session is not None else None
+                if io is None:
+                    io = BytesIO()
+                    obj.save(io, 'PNG')
+                doc = run._parent._parent._parent
+                # TODO: verify correctness
+                section = doc.sections[-1]
+                width = section.page_width - section.left_margin - section.right_margin
+                run.add_picture(io, width=width)
 
             if hasattr(obj, 'caption'):
                 para = run._parent
                 return para.add_caption(obj.caption)
         elif re.search('<(.+?)>', obj):
-            html = clean_html(obj)
-            root = lxml.html.fromstring(html)
-
-            def _get_styles(elem):
-                styles = {}
-                if elem.tag == 'i':
-                    styles['font-style'] = 'italic'
-                elif elem.tag == 'b':
-                    styles['font-weight'] = 'bold'
+            with stage('html'):
+                self._insert_html(run, obj, allowed_styles, session)
+        else:
+            run.text = obj
 
-                if 'style' not in elem.attrib:
-                    return styles
+    def _insert_html(self, run, obj, allowed_styles=None, session=None):
+        import lxml.html
 
-                _styles = elem.attrib['style'].split(';')
+        html = clean_html(obj)
+        root = lxml.html.fromstring(html)
 
-                styles.update({
-                    style.split(':', 1)[0].strip(): style.split(':', 1)[1].strip() for style in _styles
-                })
+        def _get_styles(elem):
+            styles = {}
+            if elem.tag == 'i':
+                styles['font-style'] = 'italic'
+            elif elem.tag == 'b':
+                styles['font-weight'] = 'bold'
 
+            if 'style' not in elem.attrib:
                 return styles
 
-            def _get_class(elem):
-                clazz = elem.attrib.get('class')
-                if not clazz:
-                    if elem.tag == 'h1':
-                        clazz = 'Heading1'
-                    elif elem.tag == 'h2':
-                        clazz = 'Heading2'
-                    elif elem.tag == 'h3':
-                        clazz = 'Heading3'
-                    elif elem.tag == 'h4':
-                        clazz = 'Heading4'
-
-                if clazz and allowed_styles and clazz not in allowed_styles:
-                    msg = "Style %s does not exist in given template" % clazz
-                    log.critical(msg)
-                    raise ValueError(msg)
-                return clazz
-
-            def _transform(currentrun, el, is_first=False):
-                log.debug('Transforming element %s into %s', el, currentrun._r.getroottree().getpath(currentrun._r))
-                parts = [el.text] + [x for c in el for x in (c, c.tail)]
-                if isinstance(parts[0], str):
-                    currentrun.text = parts[0]
-
-                for part in parts[1:]:
-                    if part is None:
-                        continue
-                    log.debug("Run path: %s", currentrun._r.getroottree().getpath(currentrun._r))
-                    if isinstance(part, str):
-                        currentrun = currentrun._parent.append_run(currentrun, part)
-                    elif part.tag == 'p':
-                        if not is_first:
-                            log.debug('New paragraph')
-                            p = currentrun._parent.insert_paragraph_after()
-                            p.style = _get_class(part)
-                            currentrun = p.add_run()
-                        is_first = False
-                        currentrun = _transform(currentrun, part)
+            _styles = elem.attrib['style'].split(';')
+
+            styles.update({
+                style.split(':', 1)[0].strip(): style.split(':', 1)[1].strip() for style in _styles
+            })
+
+            return styles
+
+        def _get_class(elem):
+            clazz = elem.attrib.get('class')
+            if not clazz:
+                if elem.tag == 'h1':
+                    clazz = 'Heading1'
+                elif elem.tag == 'h2':
+                    clazz = 'Heading2'
+                elif elem.tag == 'h3':
+                    clazz = 'Heading3'
+                elif elem.tag == 'h4':
+                    clazz = 'Heading4'
+
+            if clazz and allowed_styles and clazz not in allowed_styles:
+                msg = "Style %s does not exist in given template" % clazz
+                log.critical(msg)
+                raise ValueError(msg)
+            return clazz
+
+        def _transform(currentrun, el, is_first=False):
+            log.debug('Transforming element %s into %s', el, currentrun._r.getroottree().getpath(currentrun._r))
+            parts = [el.text] + [x for c in el for x in (c, c.tail)]
+            if isinstance(parts[0], str):
+                currentrun.text = parts[0]
+
+            for part in parts[1:]:
+                if part is None:
+                    continue
+                log.debug("Run path: %s", currentrun._r.getroottree().getpath(currentrun._r))
+                if isinstance(part, str):
+                    currentrun = currentrun._parent.append_run(currentrun, part)
+                elif part.tag == 'p':
+                    if not is_first:
+                        log.debug('New paragraph')
+                        p = currentrun._parent.insert_paragraph_after()
+                        p.style = _get_class(part)
+                        currentrun = p.add_run()
+                    is_first = False
+                    currentrun = _transform(currentrun, part)
+                else:
+                    clazz = _get_class(part)
+                    if clazz and clazz.startswith('Heading'):
+                        log.debug('New heading')
+                        # create new paragraph
+                        p = currentrun._parent.insert_paragraph_after()
+                        p.style = clazz
+                        currentrun = p.add_run()
                     else:
-                        clazz = _get_class(part)
-                        if clazz and clazz.startswith('Heading'):
-                            log.debug('New heading')
-                            # create new paragraph
-                            p = currentrun._parent.insert_paragraph_after()
-                            p.style = clazz
-                            currentrun = p.add_run()
-                        else:
-                            currentrun = currentrun._parent.append_run(currentrun, None, style=clazz)
-                        styles = _get_styles(part)
-                        if 'color' in styles:
-                            currentrun.color = styles['color'].replace('#', '')
-                        if 'font-weight' in styles:
-                            currentrun.bold = 'bold' in styles['font-weight']
-                        if 'font-variant' in styles:
-                            currentrun.small_caps = 'small-caps' in styles['font-variant']
-                        if 'font-style' in styles:
-                            currentrun.italic = 'italic' in styles['font-style']
-
-                        if part.tag == 'img':
-                            log.debug('New image')
-                            img = image_factory(part.attrib.get('src'))
-                            if img is not None:
-                                img.caption = part.attrib.get('alt')
-                            p = currentrun._parent.insert_paragraph_after()
-                            currentrun = p.add_run()
-                            p = self.insert(currentrun, img)
-                            currentrun = p.runs[-1]
-                            # currentrun = p.add_run()  # maybe not optimal
-                        else:
-                            currentrun = _transform(currentrun, part)
-                return currentrun
-
-            _transform(run, root, True)
-        else:
-            run.text = obj
+                        currentrun = currentrun._parent.append_run(currentrun, None, style=clazz)
+                    styles = _get_styles(part)
+                    if 'color' in styles:
+                        currentrun.color = styles['color'].replace('#', '')
+                    if 'font-weight' in styles:
+                        currentrun.bold = 'bold' in styles['font-weight']
+                    if 'font-variant' in styles:
+                        currentrun.small_caps = 'small-caps' in styles['font-variant']
+                    if 'font-style' in styles:
+                        currentrun.italic = 'italic' in styles['font-style']
+
+                    if part.tag == 'img':
+                        log.debug('New image')
+                        src = part.attrib.get('src')
+                        img = session.image(src) if session is not None else image_factory(src)
+                        if img is not None:
+                            img.caption = part.attrib.get('alt')
+                        p = currentrun._parent.insert_paragraph_after()
+                        currentrun = p.add_run()
+                        p = self.insert(currentrun, img, session=session)
+                        currentrun = p.runs[-1]
+                        # currentrun = p.add_run()  # maybe not optimal
+                    else:
+                        currentrun = _transform(currentrun, part)
+            return currentrun
 
-    def replace(self, text, base=None, allowed_styles=None):
+        _transform(run, root, True)
+
+    def paragraph_of(self, element):
+        """
+        Paragraph containing *element*. Clones share the parent of their
+        template field, so it is only used if it wraps the same element.
+        """
+        p = element.getparent()
+        if self._parent._p is p:
+            return self._parent
+        return Paragraph(p, self._parent._parent)
+
+    def replace(self, text, base=None, allowed_styles=None, session=None):
         log.debug("Replacing content from %s with '%s' in %s", self, text, base)
         if base is None or True:
             start, end = self.start, self.end
@@ -393,10 +493,10 @@ class Field(Parented):
                 break
 
         if start.tag.endswith('r'):
-            r = Run(start, self._parent)
+            r = Run(start, self.paragraph_of(start))
             if hasattr(r._r, 'clear_content'):
                 r._r.clear_content()
-            self.insert(r, text, allowed_styles=allowed_styles)
+            self.insert(r, text, allowed_styles=allowed_styles, session=session)
             return r
         else:
             # TODO
@@ -427,17 +527,6 @@ class Field(Parented):
                 log.warning("No parent for paragraph %s", p)
                 log.debug("Text: %s, Style: %s", p.text, p.style)
 
-    def update_xpaths(self, root_xpath, base_xpath):
-        self.__start = None
-        xp = make_relative(self.xpath_start, root_xpath)
-        xp = make_abs(xp, base_xpath)
-        self.xpath_start = xp
-
-        self.__end = None
-        xp = make_relative(self.xpath_end, root_xpath)
-        xp = make_abs(xp, base_xpath)
-        self.xpath_end = xp
-
 
 # noinspection PyProtectedMember
 def _fields(self):
@@ -448,6 +537,7 @@ def _fields(self):
     instr = qn('w:instr')
     root = self._p.getroottree()
     instructions = ''
+    default = None
 
     for run in self.runs:
         for chld in run._r.getchildren():
@@ -457,58 +547,30 @@ def _fields(self):
                     field = Field(self)
                     field.xpath_start = root.getpath(run._r)
                 elif chld.attrib.get(fldCharType) == 'end' and field is not None:
-                    if instructions:
-                        lex = shlex.shlex(instructions, posix=True)
-                        lex.whitespace_split = True
-                        lex.commenters = ''
-                        lex.escape = ''
-                        try:
-                            tokens = list(lex)
-                        except ValueError as e:
-                            raise ParserException(str(e) + chld.text, chld)
-
-                        field.code = tokens[0]
-                        fmt_target = None
-                        for token in tokens[1:]:
-                            if fmt_target is not None:
-                                field.format[fmt_target].append(token)
-                                fmt_target = None
-                            elif token.startswith('\\'):
-                                fmt_target = token[1:]
-                            else:
-                                field.extra.append(token)
+                    try:
+                        field.instruction = Instruction.parse(instructions, default) if instructions \
+                            else Instruction(default=default)
+                    except ValueError as e:
+                        raise ParserException(str(e) + chld.text, chld)
                     field.xpath_end = root.getpath(run._r)
                     fields.append(field)
                     field = None
                     instructions = ''
+                    default = None
             elif field:
                 if tag == 't':
-                    field.default = chld.text
+                    default = chld.text
                 elif tag == 'instrText' and chld.text.strip():
                     instructions += chld.text
 
     for fld in self._p.xpath('./w:fldSimple'):
         if fld.attrib.get(instr):
-            field = Field(self)
+            default = None
+            if fld.find(qn('w:r')):
+                default = fld.find(qn('w:r'))[0].text
+            field = Field(self, instruction=Instruction.parse(fld.attrib.get(instr), default))
             field.xpath_start = root.getpath(fld)
             field.xpath_end = root.getpath(fld)
-            if fld.find(qn('w:r')):
-                field.default = fld.find(qn('w:r'))[0].text
-            lex = shlex.shlex(fld.attrib.get(instr), posix=True)
-            lex.whitespace_split = True
-            lex.commenters = ''
-            lex.escape = ''
-            tokens = list(lex)
-            field.code = tokens[0]
-            fmt_target = None
-            for token in tokens[1:]:
-                if fmt_target is not None:
-                    field.format[fmt_target].append(token)
-                    fmt_target = None
-                elif token.startswith('\\'):
-                    fmt_target = token[1:]
-                else:
-                    field.extra.append(token)
             fields.append(field)
     return fields
 
@@ -0,0 +1,214 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+import logging
+from copy import deepcopy
+
+from lxml.etree import Comment
+
+from . import init
+from .document import StoryIndex
+from .parser import Context, build_tree, gen_tree, is_iterator
+from .utils import Default
+
+
+__author__ = 'bluec0re'
+
+log = logging.getLogger(__name__)
+
+
+def _block(body, element):
+    while element.getparent() is not body:
+        element = element.getparent()
+    return element
+
+
+def affected(dependencies, changes):
+    """
+    >>> affected({'items', 'author'}, ['author'])
+    True
+    >>> affected({'items'}, ['items.0.name'])
+    True
+    >>> affected({'item.name'}, ['item'])
+    True
+    >>> affected({'items'}, ['itemsX', 'author'])
+    False
+    """
+    for dep in dependencies:
+        for change in changes:
+            if dep == change or dep.startswith(change + '.') or change.startswith(dep + '.'):
+                return True
+    return False
+
+
+def _assign(container, keys, value):
+    """
+    Set the path *keys* in *container* to *value*. Missing mapping keys are
+    created, list and tuple items are addressed by their index. Tuples are
+    replaced by changed copies, so the changed container is returned.
+
+    >>> _assign({'items': [{'name': 'a'}]}, ['items', '0', 'name'], 'b')
+    {'items': [{'name': 'b'}]}
+    >>> _assign({'items': ('a', 'b')}, ['items', '1'], 'c')
+    {'items': ('a', 'c')}
+    >>> _assign({'items': ['a']}, ['items', '1'], 'c')
+    Traceback (most recent call last):
+    ...
+    KeyError: '1'
+    """
+    key = keys[0]
+    if isinstance(container, dict):
+        item = container.setdefault(key, {}) if len(keys) > 1 else None
+    elif isinstance(container, (list, tuple)) and key.isdigit() and int(key) < len(container):
+        key = int(key)
+        item = container[key]
+    else:
+        raise KeyError(key)
+
+    if len(keys) > 1:
+        value = _assign(item, keys[1:], value)
+    if isinstance(container, tuple):
+        return container[:key] + (value,) + container[key + 1:]
+    container[key] = value
+    return container
+
+
+def _materialize(value):
+    """
+    *value* with single-pass iterators replaced by lists, as segments are
+    rendered more than once. Dicts and lists are changed in place.
+
+    >>> _materialize({'items': (x for x in 'ab'), 'rows': [iter('c')]})
+    {'items': ['a', 'b'], 'rows': [['c']]}
+    """
+    if is_iterator(value):
+        value = list(value)
+    if isinstance(value, dict):
+        for key, item in value.items():
+            value[key] = _materialize(item)
+    elif isinstance(value, list):
+        value[:] = [_materialize(item) for item in value]
+    elif isinstance(value, tuple):
+        value = tuple(_materialize(item) for item in value)
+    return value
+
+
+class Segment(Default):
+    """
+    Range of body level elements rendered by a group of top level nodes. The
+    pristine template elements are kept to re-render it, the rendered output
+    sits between two XML comments in the document body, which Word ignores.
+    """
+    __slots__ = ('template', 'dependencies', '_begin', '_end')
+
+    def __init__(self, template, begin, end):
+        super(Segment, self).__init__()
+        self.template = template
+        self.dependencies = set()
+        self._begin = begin
+        self._end = end
+
+    def output(self):
+        elements = []
+        for el in self._begin.itersiblings():
+            if el == self._end:
+                break
+            elements.append(el)
+        return elements
+
+    def reset(self):
+        for el in self.output():
+            el.getparent().remove(el)
+
+        elements = [deepcopy(el) for el in self.template]
+        anchor = self._begin
+        for el in elements:
+            anchor.addnext(el)
+            anchor = el
+        return elements
+
+
+class IncrementalRender(Default):
+    """
+    Renders a document and keeps, for every group of top level fields, the
+    context paths it read. :meth:`update` re-evaluates only the groups that
+    depend on the changed paths, all other output is kept as it is.
+
+    Image parts of replaced output stay in the package. Generators and other
+    single-pass iterators in the context are turned into lists, the loops
+    over them are evaluated again on updates.
+    """
+    __slots__ = ('context', 'segments', 'allowed_styles', '_doc')
+
+    # noinspection PyProtectedMember
+    def __init__(self, doc, context, allowed_styles=None):
+        super(IncrementalRender, self).__init__()
+        init()
+        self._doc = doc
+        self.context = context if isinstance(context, Context) else Context(context)
+        _materialize(self.context.variables)
+        self.allowed_styles = allowed_styles
+        self.segments = []
+
+        body = doc._document_part._element.body
+        spans = []
+        for node in gen_tree(doc).childs:
+            first = _block(body, node.field.start)
+            last = first
+            if getattr(node, 'end', None) is not None:
+                last = _block(body, node.end.start)
+            spans.append((body.index(first), body.index(last)))
+
+        merged = []
+        for first, last in sorted(spans):
+            if merged and first <= merged[-1][1]:
+                merged[-1][1] = max(last, merged[-1][1])
+            else:
+                merged.append([first, last])
+
+        # insert markers from the back, so the indices stay valid
+        for first, last in reversed(merged):
+            template = [deepcopy(el) for el in body[first:last + 1]]
+            begin, end = Comment('segment'), Comment('end segment')
+            body[last].addnext(end)
+            body[first].addprevious(begin)
+            self.segments.insert(0, Segment(template, begin, end))
+        log.debug("%d segments found", len(self.segments))
+
+    def render(self):
+        for segment in self.segments:
+            self._render(segment)
+        self._doc.invalidate_stories()
+
+    def update(self, changes):
+        """
+        Apply *changes* (a dict of dotted paths to new values) to the context
+        and re-render the affected segments. Returns their number. Items of
+        lists and tuples are addressed by their index, e.g. ``items.0.name``.
+        """
+        self.context.reset_providers()
+        for path, value in changes.items():
+            try:
+                _assign(self.context.variables, path.split('.'), _materialize(value))
+            except KeyError as e:
+                raise KeyError("Can't set %s: %s is no key or index of its parent" % (path, e.args[0]))
+
+        dirty = [s for s in self.segments if affected(s.dependencies, changes)]
+        log.info("Re-rendering %d of %d segments", len(dirty), len(self.segments))
+        for segment in dirty:
+            self._render(segment)
+        if dirty:
+            self._doc.invalidate_stories()
+        return len(dirty)
+
+    # noinspection PyProtectedMember
+    def _render(self, segment):
+        elements = segment.reset()
+        tree = build_tree(StoryIndex(self._doc._document_part, elements).fields())
+
+        self.context.dependencies = set()
+        try:
+            tree.evaluate(self.context, allowed_styles=self.allowed_styles)
+            segment.dependencies = self.context.dependencies
+        finally:
+            self.context.dependencies = None
@@ -0,0 +1,250 @@
+# encoding: utf-8
+"""
+Opt-in memory accounting of the render stages.
+
+    with MemoryProfile() as profile:
+        render('template.docx', context, 'out.docx')
+    print(profile.report())
+
+Stages nest, their names are joined with ``/``. Python allocations are
+traced with tracemalloc, the resident set size is sampled by a thread, so
+the memory of lxml and PIL shows up there as well. Without an active
+profile, :func:`stage` does nothing.
+
+tracemalloc is process wide: only one profile can be active at a time, and
+renders in other threads are accounted to its stages. Stages nest per
+thread, but their peaks include the allocations of all threads. Before
+Python 3.9 the traced peak can't be reset, a stage's peak is then the
+highest one since the start of the profile.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import os
+import threading
+import tracemalloc
+
+from .utils import Default
+
+
+__author__ = 'bluec0re'
+
+log = logging.getLogger(__name__)
+
+_active = None
+
+# Python 3.9+
+_reset_peak = getattr(tracemalloc, 'reset_peak', lambda: None)
+
+
+def rss():
+    """
+    Resident set size of the process in bytes, None if it is unknown.
+    """
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def _size(value):
+    """
+    >>> _size(3 * 1024 * 1024), _size(-2048), _size(None)
+    ('3.0 MiB', '-2.0 KiB', '-')
+    """
+    if value is None:
+        return '-'
+    if abs(value) < 1024 * 1024:
+        return '%.1f KiB' % (value / 1024.0)
+    return '%.1f MiB' % (value / 1024.0 / 1024.0)
+
+
+class StageStats(Default):
+    """
+    Memory of all runs of a stage: the highest *peak* over its start, the
+    sum of the *retained* memory (both traced by tracemalloc) and the
+    highest sampled RSS.
+    """
+    __slots__ = ('name', 'count', 'peak', 'retained', 'rss_peak')
+
+    def __init__(self, name):
+        super(StageStats, self).__init__()
+        self.name = name
+        self.count = 0
+        self.peak = 0
+        self.retained = 0
+        self.rss_peak = None
+
+
+class _Frame(object):
+    __slots__ = ('stats', 'start', 'peak', 'rss_peak')
+
+    def __init__(self, stats, start):
+        self.stats = stats
+        self.start = start
+        self.peak = start
+        self.rss_peak = rss()
+
+
+class _Stage(object):
+    __slots__ = ('profile', 'name')
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.profile._enter(self.name)
+
+    def __exit__(self, *exc_info):
+        self.profile._exit()
+
+
+class _NoStage(object):
+    __slots__ = ()
+
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc_info):
+        pass
+
+_no_stage = _NoStage()
+
+
+def stage(name):
+    """
+    Context manager accounting its block to the stage *name* of the active
+    profile. Does nothing without one or if *name* is None.
+    """
+    if _active is None or name is None:
+        return _no_stage
+    return _Stage(_active, name)
+
+
+class MemoryProfile(Default):
+    """
+    Collects the memory of the stages run while it is active. *top* is the
+    number of allocation sites reported, *interval* the RSS sampling period
+    in seconds.
+    """
+    __slots__ = ('stages', 'sites', 'top', 'interval', 'rss_start', 'rss_end',
+                 '_local', '_stacks', '_lock', '_snapshot', '_tracing', '_sampler', '_stopped')
+
+    def __init__(self, top=10, interval=0.01):
+        super(MemoryProfile, self).__init__()
+        self.stages = {}
+        self.sites = []
+        self.top = top
+        self.interval = interval
+        self.rss_start = self.rss_end = None
+        # the open stages of each thread
+        self._local = threading.local()
+        self._stacks = []
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._tracing = False
+        self._sampler = None
+        self._stopped = threading.Event()
+
+    def __enter__(self):
+        global _active
+        if _active is not None:
+            raise RuntimeError('Another memory profile is active')
+
+        self._tracing = not tracemalloc.is_tracing()
+        if self._tracing:
+            tracemalloc.start()
+        self._snapshot = tracemalloc.take_snapshot()
+        self.rss_start = rss()
+        if self.rss_start is not None and self.interval:
+            self._sampler = threading.Thread(target=self._sample, name='rss-sampler')
+            self._sampler.daemon = True
+            self._sampler.start()
+        _active = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active
+        _active = None
+        self._stopped.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        self.rss_end = rss()
+
+        snapshot = tracemalloc.take_snapshot().filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, __file__),
+        ))
+        self.sites = [stat for stat in snapshot.compare_to(self._snapshot, 'lineno')
+                      if stat.size_diff > 0][:self.top]
+        self._snapshot = None
+        if self._tracing:
+            tracemalloc.stop()
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            value = rss()
+            with self._lock:
+                for stack in self._stacks:
+                    for frame in stack:
+                        frame.rss_peak = max(frame.rss_peak, value)
+
+    def _stack(self):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+            with self._lock:
+                self._stacks.append(stack)
+        return stack
+
+    def _record_peak(self, peak):
+        # the open stages of all threads keep the peak before it is reset
+        for stack in self._stacks:
+            for frame in stack:
+                frame.peak = max(frame.peak, peak)
+
+    def _enter(self, name):
+        stack = self._stack()
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            self._record_peak(peak)
+            if stack:
+                name = stack[-1].stats.name + '/' + name
+            stats = self.stages.get(name)
+            if stats is None:
+                stats = self.stages[name] = StageStats(name)
+            stack.append(_Frame(stats, current))
+            _reset_peak()
+
+    def _exit(self):
+        stack = self._stack()
+        current, peak = tracemalloc.get_traced_memory()
+        with self._lock:
+            self._record_peak(peak)
+            frame = stack.pop()
+            if stack and frame.rss_peak is not None:
+                parent = stack[-1]
+                parent.rss_peak = max(parent.rss_peak, frame.rss_peak)
+
+            stats = frame.stats
+            stats.count += 1
+            stats.peak = max(stats.peak, frame.peak - frame.start)
+            stats.retained += current - frame.start
+            if frame.rss_peak is not None:
+                stats.rss_peak = max(stats.rss_peak or 0, frame.rss_peak, rss())
+            _reset_peak()
+
+    def report(self):
+        lines = ['RSS %s -> %s' % (_size(self.rss_start), _size(self.rss_end)),
+                 '%-50s %6s %12s %12s %12s' % ('stage', 'runs', 'peak', 'retained', 'rss peak')]
+        for stats in self.stages.values():
+            lines.append('%-50s %6d %12s %12s %12s' % (
+                stats.name[:50], stats.count, _size(stats.peak), _size(stats.retained), _size(stats.rss_peak)))
+        lines.append('largest allocation sites:')
+        for stat in self.sites:
+            frame = stat.traceback[0]
+            lines.append('  %s:%d %s in %d blocks' % (frame.filename, frame.lineno, _size(stat.size_diff),
+                                                      stat.count_diff))
+        return '\n'.join(lines)
@@ -0,0 +1,99 @@
+# encoding: utf-8
+"""
+Normalization of Word's run fragmentation: proofing marks, revision ids and
+rendering hints are removed, adjacent runs with the same formatting are
+merged. Templates get fewer nodes to scan and to clone per loop iteration,
+and field instructions split over several runs are joined.
+
+Only lxml is used, so the jinja preprocessor can use it without docx.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import logging
+
+from lxml import etree
+
+
+__author__ = 'bluec0re'
+
+log = logging.getLogger(__name__)
+
+# bump on every change of the produced output, it invalidates cached templates
+__version__ = '0.1'
+
+W = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+XML_SPACE = '{http://www.w3.org/XML/1998/namespace}space'
+
+# noise Word adds while editing, none of it changes the document
+NOISE = ('{%s}proofErr' % W, '{%s}lastRenderedPageBreak' % W)
+
+RUN = '{%s}r' % W
+RPR = '{%s}rPr' % W
+TEXTS = ('{%s}t' % W, '{%s}instrText' % W)
+
+
+def is_rsid(name):
+    """
+    >>> is_rsid('{%s}rsidRPr' % W), is_rsid('{%s}val' % W)
+    (True, False)
+    """
+    return name.startswith('{%s}rsid' % W)
+
+
+def _text_kind(run):
+    """
+    Tag of the text elements if *run* contains only them (besides its
+    properties), else None.
+    """
+    kind = None
+    for child in run:
+        if child.tag == RPR:
+            continue
+        if child.tag not in TEXTS or (kind is not None and child.tag != kind):
+            return None
+        kind = child.tag
+    return kind
+
+
+def _properties(run):
+    rpr = run.find(RPR)
+    if rpr is None:
+        return b''
+    return etree.tostring(rpr, method='c14n')
+
+
+def _merge(target, run):
+    texts = [child for child in target if child.tag != RPR]
+    last = texts[-1]
+    last.text = (last.text or '') + ''.join(child.text or '' for child in run if child.tag != RPR)
+    if last.text != last.text.strip():
+        last.set(XML_SPACE, 'preserve')
+    run.getparent().remove(run)
+
+
+def normalize(root):
+    """
+    Normalize the runs below *root* in place. Returns the number of nodes
+    before and after.
+    """
+    before = sum(1 for _ in root.iter())
+
+    for el in list(root.iter(*NOISE)):
+        el.getparent().remove(el)
+    for el in root.iter():
+        for name in [name for name in el.attrib if is_rsid(name)]:
+            del el.attrib[name]
+
+    previous = kind = properties = None
+    for run in list(root.iter(RUN)):
+        run_kind = _text_kind(run)
+        run_properties = _properties(run) if run_kind else None
+        if run_kind and previous is not None and run.getprevious() is previous and \
+                run_kind == kind and run_properties == properties:
+            _merge(previous, run)
+            continue
+        previous, kind, properties = (run, run_kind, run_properties) if run_kind else (None, None, None)
+
+    after = sum(1 for _ in root.iter())
+    log.info("Normalized %d nodes to %d", before, after)
+    return before, after
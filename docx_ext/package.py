@@ -0,0 +1,237 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import os
+import struct
+import time
+import zipfile
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from copy import copy
+from io import BytesIO
+
+
+__author__ = 'bluec0re'
+
+log = logging.getLogger(__name__)
+
+
+def _strip_declaration(data):
+    """
+    >>> _strip_declaration(b"<?xml version='1.0'?>\\r\\n<a/>")
+    (b"<?xml version='1.0'?>\\r\\n", b'<a/>')
+    >>> _strip_declaration(b'PNG')
+    (b'', b'PNG')
+    """
+    if not data.startswith(b'<?xml'):
+        return b'', data
+    end = data.index(b'?>') + 2
+    body = data[end:].lstrip()
+    return data[:len(data) - len(body)], body
+
+
+def _open_source(source, target):
+    if source is None:
+        return None
+    try:
+        if isinstance(target, str) and isinstance(source, str) and \
+                os.path.exists(target) and os.path.samefile(source, target):
+            # the target is truncated before the members are copied
+            with open(source, 'rb') as fp:
+                source = BytesIO(fp.read())
+        return zipfile.ZipFile(source)
+    except (IOError, OSError, ValueError, zipfile.BadZipfile) as e:
+        log.debug("Source package not readable, writing all parts: %s", e)
+        return None
+
+
+def _compress(name, blob, level):
+    info = zipfile.ZipInfo(name, time.localtime(time.time())[:6])
+    info.external_attr = 0o600 << 16
+    info.file_size = len(blob)
+    info.CRC = zlib.crc32(blob) & 0xffffffff
+    if level == 0:
+        info.compress_type = zipfile.ZIP_STORED
+        data = blob
+    else:
+        info.compress_type = zipfile.ZIP_DEFLATED
+        compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION if level is None else level,
+                                      zlib.DEFLATED, -15)
+        data = compressor.compress(blob) + compressor.flush()
+    info.compress_size = len(data)
+    return info, data
+
+
+def iter_parts(package):
+    """
+    Parts of *package* in the order of ``package.iter_parts()``, which
+    remembers the parts seen in all its calls and so skips parts shared
+    between packages.
+    """
+    visited = set()
+
+    def walk(source):
+        for rel in source.rels.values():
+            if rel.is_external or rel.target_part in visited:
+                continue
+            visited.add(rel.target_part)
+            yield rel.target_part
+            for part in walk(rel.target_part):
+                yield part
+
+    return walk(package)
+
+
+class PackageWriter(object):
+    """
+    Writes zip members to *target*. Members whose content equals the one in
+    the *source* package are copied as they are, without compressing them
+    again. XML declarations are ignored in the comparison, as lxml writes
+    them differently than Word.
+
+    The other members are compressed with *level* (0 stores them) on up to
+    *workers* threads and written in the order they were given on
+    :meth:`close`.
+    """
+
+    def __init__(self, target, source=None, level=None, workers=None):
+        self.source = _open_source(source, target)
+        self.zipf = zipfile.ZipFile(target, 'w', compression=zipfile.ZIP_DEFLATED)
+        self.level = level
+        workers = workers or min(4, os.cpu_count() or 1)
+        self.pool = ThreadPoolExecutor(max_workers=workers) if workers > 1 else None
+        self.copied = 0
+        self.written = 0
+        self._pending = []
+
+    def unchanged(self, name, blob):
+        try:
+            info = self.source.getinfo(name)
+        except KeyError:
+            return None
+        if info.flag_bits & 0x1:
+            return None
+
+        declaration, body = _strip_declaration(blob)
+        if declaration:
+            with self.source.open(info) as fp:
+                declaration, _ = _strip_declaration(fp.read(len(declaration) + 64))
+        if len(declaration) + len(body) != info.file_size or \
+                zlib.crc32(body, zlib.crc32(declaration)) & 0xffffffff != info.CRC:
+            return None
+        return info
+
+    def write(self, name, blob):
+        info = self.source is not None and self.unchanged(name, blob)
+        if info:
+            self._pending.append(info)
+            self.copied += 1
+        else:
+            log.debug("Writing %s", name)
+            if self.pool is None:
+                self._pending.append(_compress(name, blob, self.level))
+            else:
+                self._pending.append(self.pool.submit(_compress, name, blob, self.level))
+            self.written += 1
+
+    def copy(self, name):
+        """
+        Copy the member *name* of the source package.
+        """
+        if self.source is None:
+            raise ValueError("Can't copy %s, the source package is not readable" % name)
+        self._pending.append(self.source.getinfo(name))
+        self.copied += 1
+
+    def open(self, name):
+        """
+        Writable stream of the member *name*. It follows the members given
+        before, so they are written first.
+        """
+        self.flush()
+        return self.zipf.open(name, 'w', force_zip64=True)
+
+    def _raw(self, info):
+        fp = self.source.fp
+        fp.seek(info.header_offset)
+        name_length, extra_length = struct.unpack('<HH', fp.read(zipfile.sizeFileHeader)[-4:])
+        fp.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+        return info, fp.read(info.compress_size)
+
+    def flush(self):
+        for entry in self._pending:
+            if isinstance(entry, zipfile.ZipInfo):
+                entry = self._raw(entry)
+            elif not isinstance(entry, tuple):
+                entry = entry.result()
+            self._write_raw(*entry)
+        self._pending = []
+
+    # noinspection PyProtectedMember
+    def _write_raw(self, info, data):
+        info = copy(info)
+        # sizes and crc go into the local header, no data descriptor follows
+        info.flag_bits &= ~0x08
+        info.header_offset = self.zipf.fp.tell()
+        self.zipf.fp.write(info.FileHeader())
+        self.zipf.fp.write(data)
+        self.zipf.filelist.append(info)
+        self.zipf.NameToInfo[info.filename] = info
+        self.zipf.start_dir = self.zipf.fp.tell()
+        self.zipf._didModify = True
+
+    def write_package(self, package, skip=(), unchanged=()):
+        """
+        Write all parts of *package* except the ones in *skip*, their
+        relationships and the content types. The parts in *unchanged* and
+        their relationships are copied from the source without serializing
+        them.
+        """
+        from docx.opc.packuri import CONTENT_TYPES_URI, PACKAGE_URI
+        from docx.opc.pkgwriter import _ContentTypesItem
+
+        parts = list(iter_parts(package))
+        for part in parts:
+            if part not in unchanged:
+                part.before_marshal()
+        self.write(CONTENT_TYPES_URI.membername, _ContentTypesItem.from_parts(parts).blob)
+        self.write(PACKAGE_URI.rels_uri.membername, package.rels.xml)
+        for part in parts:
+            if part in unchanged and self.source is not None:
+                self.copy(part.partname.membername)
+                if len(part._rels):
+                    self.copy(part.partname.rels_uri.membername)
+                continue
+            if part not in skip:
+                self.write(part.partname.membername, part.blob)
+            if len(part._rels):
+                self.write(part.partname.rels_uri.membername, part._rels.xml)
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            if self.pool is not None:
+                self.pool.shutdown()
+            if self.source is not None:
+                self.source.close()
+            self.zipf.close()
+        log.debug("%d members copied, %d written", self.copied, self.written)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+# noinspection PyProtectedMember
+def save(doc, target, level=None, workers=None):
+    """
+    Save *doc* to *target*, copying unchanged parts from the file it was
+    loaded from.
+    """
+    with PackageWriter(target, getattr(doc, '_source', None), level, workers) as writer:
+        # parts shared with a pooled template (see docx_ext.pool)
+        writer.write_package(doc._package, unchanged=getattr(doc, '_shared', ()))
@@ -6,10 +6,15 @@ from copy import deepcopy
 import re
 import sys
 
+from docx.oxml.ns import qn
+from docx.text import Paragraph
+from lxml.etree import Comment
+
 if sys.version > '3':
     unicode = str
 
-from .utils import Default, make_relative, make_abs
+from .memory import stage
+from .utils import Default, Location, slot_names
 
 log = logging.getLogger(__name__)
 
@@ -29,74 +34,438 @@ class ParserException(Default, Exception):
             return self.msg
 
 
+class Provider(Default):
+    """
+    Context value computed on its first access during a render. Only values
+    wrapped in a provider are called, other callables are kept as they are.
+    """
+    __slots__ = ('func', 'name')
+
+    def __init__(self, func, name=None):
+        super(Provider, self).__init__()
+        self.func = func
+        self.name = name
+
+    def __call__(self):
+        return self.func()
+
+
+def is_provider(value):
+    return isinstance(value, Provider)
+
+
+def is_iterator(value):
+    """
+    Whether *value* is a single-pass iterator (a generator, cursor, ...),
+    which is empty once it was looped over.
+
+    >>> is_iterator(x for x in 'ab'), is_iterator(['a', 'b']), is_iterator('ab')
+    (True, False, False)
+    """
+    return hasattr(value, '__iter__') and iter(value) is value
+
+
+class Columns(Default):
+    """
+    Columnar loop source: a mapping of column names to equally long sequences
+    (lists, tuples or NumPy arrays). A loop over it resolves ``$row.column``
+    by index instead of building a dict per row. Plain dicts are never taken
+    as columns, the source has to be wrapped.
+
+    >>> len(Columns({'name': ['a', 'b'], 'size': [1, 2]}))
+    2
+    """
+    __slots__ = ('columns', '_length', '_texts')
+
+    def __init__(self, columns):
+        super(Columns, self).__init__()
+        lengths = set(len(column) for column in columns.values())
+        if len(lengths) > 1:
+            raise ValueError("Columns differ in length: %s" % sorted(lengths))
+        self.columns = columns
+        self._length = lengths.pop() if lengths else 0
+        self._texts = {}
+
+    def __len__(self):
+        return self._length
+
+    def text(self, name):
+        """
+        Column *name* with numbers converted to text, once for the whole column.
+        """
+        if name not in self._texts:
+            column = self.columns.get(name)
+            if column is None:
+                texts = None
+            elif getattr(getattr(column, 'dtype', None), 'kind', None) in ('i', 'u', 'f'):
+                texts = column.astype(unicode)
+            else:
+                texts = [to_text(value) for value in column]
+            self._texts[name] = texts
+        return self._texts[name]
+
+
+class ColumnRow(object):
+    """
+    Row view on :class:`Columns`, moved along by the loop.
+    """
+    __slots__ = ('source', 'index')
+
+    def __init__(self, source, index=0):
+        self.source = source
+        self.index = index
+
+    def get(self, key, default=None):
+        column = self.source.columns.get(key)
+        if column is None:
+            return default
+        return column[self.index]
+
+    def text(self, key):
+        texts = self.source.text(key)
+        if texts is None:
+            return None
+        return texts[self.index]
+
+
+class Chunk(Default):
+    """
+    Loop source holding the *items* at *offset* of a loop over *total* items,
+    so the loop flags are the ones of the whole loop.
+    """
+    __slots__ = ('items', 'offset', 'total')
+
+    def __init__(self, items, offset, total):
+        super(Chunk, self).__init__()
+        self.items = items
+        self.offset = offset
+        self.total = total
+
+    def __len__(self):
+        return len(self.items)
+
+
+def to_text(value):
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return unicode(value)
+    return value
+
+
 class Context(Default):
-    def __init__(self, variables=None, parent=None, root=None):
+    __slots__ = ('root', 'variables', 'parent', 'dependencies', 'used_providers', 'session', '_memo')
+
+    def __init__(self, variables=None, parent=None, root=None, session=None):
         super(Context, self).__init__()
         self.root = root
         self.variables = variables or {}
         self.parent = parent
+        # set of resolved paths, only recorded if not None
+        self.dependencies = None
+
+        # provider results and the render session are shared with the whole
+        # context chain
+        if parent is not None:
+            self.used_providers = parent.used_providers
+            self.session = parent.session
+            self._memo = parent._memo
+        else:
+            from .session import Session
+            self.used_providers = []
+            self.session = session if session is not None else Session()
+            self._memo = {}
+
+    def provide(self, value, key=None):
+        if not is_provider(value):
+            return value
+
+        if id(value) not in self._memo:
+            name = getattr(value, 'name', None) or key
+            log.debug("Calling provider %s", name)
+            # keep the provider alive, so its id stays unique
+            self._memo[id(value)] = (value, value())
+            self.used_providers.append(name)
+        return self._memo[id(value)][1]
+
+    def reset_providers(self):
+        self._memo.clear()
+        del self.used_providers[:]
+
+    def unused_providers(self):
+        unused = []
+
+        def walk(value, path):
+            if is_provider(value):
+                if id(value) not in self._memo:
+                    unused.append('.'.join(path))
+            elif isinstance(value, dict):
+                for key, child in value.items():
+                    walk(child, path + [key])
+            elif isinstance(value, (list, tuple)):
+                for i, child in enumerate(value):
+                    walk(child, path + [str(i)])
+
+        walk(self.variables, [])
+        return unused
 
     def resolve(self, path, variables=None):
         if variables is None:
             variables = self.variables
+            if self.dependencies is not None:
+                self.dependencies.add(path if not isinstance(path, list) else '.'.join(path))
 
-        if not isinstance(variables, dict):
+        if not isinstance(variables, (dict, ColumnRow)):
             return variables
 
         if not isinstance(path, list):
             path = path.split('.')
 
         if len(path) == 1:
-            result = variables.get(path[0])
+            result = self.provide(variables.get(path[0]), path[0])
         else:
-            result = self.resolve(path[1:], variables.get(path[0]))
+            result = self.resolve(path[1:], self.provide(variables.get(path[0]), path[0]))
 
         if result is None and self.parent is not None:
             return self.parent.resolve(path)
         else:
             return result
 
+    def resolve_text(self, path):
+        """
+        Like :meth:`resolve`, but numbers are returned as text. Values of
+        columnar rows are converted for their whole column at once.
+        """
+        head, _, key = path.rpartition('.')
+        if head:
+            row = self.resolve(head)
+            if isinstance(row, ColumnRow):
+                return row.text(key)
+        return to_text(self.resolve(path))
+
+
+def is_constant(paths, constants, bound=()):
+    """
+    Whether all *paths* are looked up in the *constants* context and none of
+    them in a name bound by an enclosing loop.
+
+    >>> is_constant(['author', 'company.name'], Context({'author': 'Me', 'company': {}}))
+    True
+    >>> is_constant(['author', 'item.name'], Context({'author': 'Me', 'item': {}}), {'item'})
+    False
+    """
+    for path in paths:
+        head = path.split('.', 1)[0]
+        if head in bound or head not in constants.variables:
+            return False
+    return True
+
+
+class Node(Default):
+    __slots__ = ()
+
+    # attributes holding per-instance anchors, everything else is shared
+    # between a node and its clones
+    _cloned = ('field', 'start', 'end', 'childs', '_content')
+
+    def __deepcopy__(self, memo):
+        clone = type(self).__new__(type(self))
+        memo[id(self)] = clone
+        for key in slot_names(type(self)):
+            if not hasattr(self, key):
+                continue
+            value = getattr(self, key)
+            if key in self._cloned:
+                value = deepcopy(value, memo)
+            setattr(clone, key, value)
+
+        for child in getattr(clone, 'childs', ()):
+            if getattr(child, 'parent', None) is self:
+                child.parent = clone
+        return clone
+
+    def partial(self, constants, bound=frozenset(), allowed_styles=None, removals=None):
+        """
+        Evaluate what depends on the *constants* context only, names in
+        *bound* are set by enclosing loops. Everything else is left for the
+        later evaluation against the full context.
+        """
+        raise NotImplementedError
+
+    def label(self):
+        return type(self).__name__
+
+
+class FieldBased(Node):
+    __slots__ = ()
 
-class FieldBased(Default):
     def __init__(self, field):
         super(FieldBased, self).__init__()
         self.field = field
 
 
-class Container(Default):
+class ContentRange(object):
+    """
+    Elements between the paragraphs of a container's start and end field,
+    kept as references to the first and last element plus their count.
+    """
+    __slots__ = ('first', 'last', 'count')
+
+    def __init__(self, first=None, last=None, count=0):
+        self.first = first
+        self.last = last
+        self.count = count
+
+    @classmethod
+    def between(cls, before, after):
+        result = cls()
+        for el in before.itersiblings():
+            if el == after:
+                break
+
+            if result.first is None:
+                result.first = el
+            result.last = el
+            result.count += 1
+        return result
+
+    def matches(self, before, after):
+        """
+        Whether the range is still exactly the elements between *before* and
+        *after*. The whole span is checked, elements added or removed inside
+        of it change the count.
+        """
+        if self.count == 0:
+            return before.getnext() == after
+        if self.first.getprevious() != before:
+            return False
+
+        el = self.first
+        for _ in range(self.count - 1):
+            el = el.getnext()
+            if el is None or el == after:
+                return False
+        return el == self.last and el.getnext() == after
+
+    def __iter__(self):
+        el = self.first
+        for _ in range(self.count):
+            yield el
+            el = el.getnext()
+
+    def __len__(self):
+        return self.count
+
+    def __deepcopy__(self, memo):
+        # element references are only valid in the tree they were taken from
+        return None
+
+
+class Removals(object):
+    """
+    Control fields collected during evaluation. They are removed in one pass
+    afterwards, together with the paragraphs left without runs.
+    """
+    __slots__ = ('starts',)
+
+    def __init__(self):
+        self.starts = []
+
+    def add(self, field):
+        start = field.start
+        if start is not None and start.tag == qn('w:r'):
+            self.starts.append(start)
+
+    def apply(self):
+        log.debug("Removing %d control fields", len(self.starts))
+        paragraphs = []
+        for start in self.starts:
+            paragraph = start.getparent()
+            if paragraph is None:
+                # already removed together with an earlier field
+                continue
+
+            # like Field.replace, everything after the field start goes
+            for el in list(start.itersiblings()):
+                paragraph.remove(el)
+            paragraph.remove(start)
+            paragraphs.append(paragraph)
+
+        for paragraph in paragraphs:
+            parent = paragraph.getparent()
+            if parent is not None and paragraph.find(qn('w:r')) is None:
+                parent.remove(paragraph)
+        self.starts = []
+
+
+class Container(Node):
+    __slots__ = ('childs', 'parent', 'start', 'end', '_document', '_content')
+
     def __init__(self, parent=None):
         super(Container, self).__init__()
         self.childs = []
         self.parent = parent
         self.start = None
         self.end = None
+        self._document = None
+        self._content = None
 
-    def evaluate(self, context, base=None, allowed_styles=None):
+    def evaluate(self, context, base=None, allowed_styles=None, removals=None):
         log.debug("Evaluating container")
+        root = removals is None
+        if root:
+            removals = Removals()
+
+        for i, c in enumerate(self.childs):
+            # memory accounting of the top level nodes, if a profile is active
+            with stage('evaluate %d %s' % (i, c.label()) if self.parent is None else None):
+                c.evaluate(context,
+                           base=base,
+                           allowed_styles=allowed_styles,
+                           removals=removals)
+        self.remove_fields(removals)
+
+        if root:
+            removals.apply()
+
+        if self._document is not None:
+            # the story index is stale after loops and ifs changed the body
+            self._document.invalidate_stories()
+
+    def partial(self, constants, bound=frozenset(), allowed_styles=None, removals=None):
+        root = removals is None
+        if root:
+            removals = Removals()
+
         for c in self.childs:
-            c.evaluate(context,
-                       base=base,
-                       allowed_styles=allowed_styles)
-        self.remove_fields()
+            c.partial(constants, bound, allowed_styles=allowed_styles, removals=removals)
 
-    def content(self):
-        elements = []
-        if self.start.end is None:
-            return elements
+        if root:
+            removals.apply()
+            if self._document is not None:
+                self._document.invalidate_stories()
 
-        root = self.start.end.getparent()
-        for el in root.itersiblings():
-            if el == self.end.start.getparent():
-                break
+    def content_range(self):
+        if self.start.end is None:
+            return ContentRange()
 
-            elements.append(el)
+        before = self.start.end.getparent()
+        after = self.end.start.getparent()
+        if self._content is None or not self._content.matches(before, after):
+            self._content = ContentRange.between(before, after)
+        return self._content
 
-        return elements
+    def content(self):
+        return list(self.content_range())
 
     def copy(self):
         return [deepcopy(e) for e in self.content()]
 
-    def remove_fields(self):
+    def remove_fields(self, removals=None):
+        if removals is not None:
+            for field in (self.start, self.end):
+                if field is not None:
+                    removals.add(field)
+            return
+
         log.debug("Removing start: %s", self.start)
         if self.start is not None:
             log.debug("Parent: %s", self.start.start.getparent())
@@ -115,29 +484,42 @@ class Container(Default):
 
 
 class Variable(FieldBased):
+    __slots__ = ('field', 'path', '_value')
+
     def __init__(self, field, path):
         super(Variable, self).__init__(field)
         self.path = path
         self._value = None
 
     def resolve(self, context):
-        return context.resolve(self.path)
+        return context.resolve_text(self.path)
+
+    def label(self):
+        return 'Variable %s' % self.path
 
-    def evaluate(self, context, base=None, allowed_styles=None):
+    def evaluate(self, context, base=None, allowed_styles=None, removals=None):
         log.debug("Evaluating variable %s", self.path)
         value = self.resolve(context)
-        self.field.replace(value, base, allowed_styles=allowed_styles)
+        self.field.replace(value, base, allowed_styles=allowed_styles, session=context.session)
+
+    def partial(self, constants, bound=frozenset(), allowed_styles=None, removals=None):
+        if is_constant([self.path], constants, bound):
+            self.evaluate(constants, allowed_styles=allowed_styles, removals=removals)
 
 
 class If(FieldBased, Container):
+    __slots__ = ('field', 'src')
+
     def __init__(self, field, parent=None, src=None):
         super(If, self).__init__(field=field)
         self.parent = parent
         self.src = src
         self.start = field
 
-    def evaluate(self, context, base=None, allowed_styles=None):
-        log.debug("Evaluating if %s", self.src)
+    def label(self):
+        return 'If %s' % self.src
+
+    def test(self, context):
         code = self.src.replace('!', ' not ')
 
         class ReplaceVars:
@@ -147,25 +529,45 @@ class If(FieldBased, Container):
 
             def __call__(self, m):
                 var = "var%d" % self._num
-                self.locals[var] = context.resolve(m.group(1))
+                value = context.resolve(m.group(1))
+                if is_iterator(value):
+                    # always true, testing it would need to consume an item
+                    raise ValueError("Can't test $%s in #if, it can only be looped over" % m.group(1))
+                self.locals[var] = value
                 self._num += 1
                 return var
 
         variables = ReplaceVars()
         code = re.sub(r'\$(\S+)', variables, code)
+        return eval(code, variables.locals, {})
 
-        if eval(code, variables.locals, {}):
+    def evaluate(self, context, base=None, allowed_styles=None, removals=None):
+        log.debug("Evaluating if %s", self.src)
+        if self.test(context):
             log.debug("If success")
             super(If, self).evaluate(context,
                                      base=base,
-                                     allowed_styles=allowed_styles)
+                                     allowed_styles=allowed_styles,
+                                     removals=removals)
         else:
             log.debug("If failed")
             self.remove_content()
-            self.remove_fields()
+            self.remove_fields(removals)
+
+    def partial(self, constants, bound=frozenset(), allowed_styles=None, removals=None):
+        if not is_constant(re.findall(r'\$(\S+)', self.src), constants, bound):
+            super(If, self).partial(constants, bound, allowed_styles=allowed_styles, removals=removals)
+        elif self.test(constants):
+            super(If, self).partial(constants, bound, allowed_styles=allowed_styles, removals=removals)
+            self.remove_fields(removals)
+        else:
+            self.remove_content()
+            self.remove_fields(removals)
 
 
 class ForEach(FieldBased, Container):
+    __slots__ = ('field', 'dest', 'src')
+
     def __init__(self, field, parent=None, dest=None, src=None):
         super(ForEach, self).__init__(field=field)
         self.parent = parent
@@ -173,145 +575,322 @@ class ForEach(FieldBased, Container):
         self.src = src
         self.start = field
 
+    def label(self):
+        return '%s %s' % (type(self).__name__, self.src)
+
     def itervalues(self, context):
+        """
+        Contexts for each item of the source. Any iterable works, the loop
+        flags are computed with a lookahead of one item, so generators and
+        cursors are never materialized (and can only be looped over once).
+        """
         src = context.resolve(self.src)
         if src is None:
             return
 
-        for i, value in enumerate(src):
-            yield Context(variables={
-                self.dest: value,
-                'foreach': {
-                    'isFirst': i == 0,
-                    'hasNext': i < len(src) - 1,
-                    'isLast': i == len(src) - 1
-                }
-            }, parent=context, root=self.field.start)
+        offset = 0
+        total = None
+        if isinstance(src, Chunk):
+            src, offset, total = src.items, src.offset, src.total
 
-    #noinspection PyProtectedMember
-    def _build_cache(self, root_xpath):
-        for old_child in self.childs:
-            cache = {'parent': old_child.field._parent}
+        if isinstance(src, Columns):
+            for new_context in self._column_contexts(context, src, offset, total):
+                yield new_context
+            return
 
-            if hasattr(old_child, 'end'):
-                cache['e_parent'] = old_child.end._parent
-            else:
-                cache['e_parent'] = None
+        items = iter(src)
+        try:
+            value = next(items)
+        except StopIteration:
+            return
 
-            if hasattr(old_child, 'start'):
-                cache['s_parent'] = old_child.start._parent
-            else:
-                cache['s_parent'] = None
+        i = offset
+        for following in items:
+            yield self._item_context(context, value, i, True)
+            value = following
+            i += 1
+        yield self._item_context(context, value, i, total is not None and i < total - 1)
+
+    def _column_contexts(self, context, columns, offset=0, total=None):
+        # a single context is moved along the rows, it is only valid until
+        # the next one is requested
+        row = ColumnRow(columns)
+        flags = {}
+        new_context = Context(variables={
+            self.dest: row,
+            'foreach': flags
+        }, parent=context, root=self.field.start)
+
+        if total is None:
+            total = offset + len(columns)
+        for i in range(len(columns)):
+            row.index = i
+            flags['isFirst'] = offset + i == 0
+            flags['hasNext'] = offset + i < total - 1
+            flags['isLast'] = offset + i == total - 1
+            yield new_context
+
+    def _item_context(self, context, value, i, has_next):
+        return Context(variables={
+            self.dest: value,
+            'foreach': {
+                'isFirst': i == 0,
+                'hasNext': has_next,
+                'isLast': not has_next
+            }
+        }, parent=context, root=self.field.start)
 
-            cache['field.xpath_start'] = make_relative(old_child.field.xpath_start, root_xpath)
-            cache['field.xpath_end'] = make_relative(old_child.field.xpath_end, root_xpath)
+    #noinspection PyProtectedMember
+    def _build_cache(self, elements, childs=None):
+        """
+        Locations of the children's anchors inside the loop body *elements*.
+        Those of nested containers' children are located as well, they are
+        inside the body too.
+        """
+        for old_child in self.childs if childs is None else childs:
+            cache = {
+                'parent': old_child.field._parent,
+                'field': (Location.of(elements, old_child.field.start),
+                          Location.of(elements, old_child.field.end)),
+            }
 
             if hasattr(old_child, 'start') and old_child.start != old_child.field:
-                cache['start.xpath_start'] = make_relative(old_child.start.xpath_start, root_xpath)
-                cache['start.xpath_end'] = make_relative(old_child.start.xpath_end, root_xpath)
+                cache['s_parent'] = old_child.start._parent
+                cache['start'] = (Location.of(elements, old_child.start.start),
+                                  Location.of(elements, old_child.start.end))
 
             if hasattr(old_child, 'end'):
-                cache['end.xpath_start'] = make_relative(old_child.end.xpath_start, root_xpath)
-                cache['end.xpath_end'] = make_relative(old_child.end.xpath_end, root_xpath)
+                cache['e_parent'] = old_child.end._parent
+                cache['end'] = (Location.of(elements, old_child.end.start),
+                                Location.of(elements, old_child.end.end))
+
+            if getattr(old_child, 'childs', None):
+                cache['childs'] = list(self._build_cache(elements, old_child.childs))
             yield cache
 
-    def evaluate(self, context, base=None, allowed_styles=None):
+    #noinspection PyProtectedMember
+    def _anchor(self, node, cache, elements):
+        # preserve xml tree connection (deepcopy makes a unlinked element)
+        node.field._parent = cache['parent']
+        node.field.anchor(*[location.resolve(elements) for location in cache['field']])
+
+        if 'start' in cache:
+            log.debug('Update start for %s', node)
+            node.start._parent = cache['s_parent']
+            node.start.anchor(*[location.resolve(elements) for location in cache['start']])
+
+        if 'end' in cache:
+            log.debug('Update end for %s', node)
+            node.end._parent = cache['e_parent']
+            node.end.anchor(*[location.resolve(elements) for location in cache['end']])
+
+        for child, child_cache in zip(getattr(node, 'childs', ()), cache.get('childs', ())):
+            self._anchor(child, child_cache, elements)
+
+    def _bind_children(self, child_cache, elements):
+        """
+        Copies of the children anchored in *elements*, a copy of the loop body.
+        """
+        children = []
+        for cache, old_child in zip(child_cache, self.childs):
+            new_child = deepcopy(old_child)
+            self._anchor(new_child, cache, elements)
+            children.append(new_child)
+        return children
+
+    @staticmethod
+    def _insert_copy(template, before):
+        """
+        Copy of the loop body *template*, inserted in front of *before*.
+        """
+        elements = [deepcopy(el) for el in template]
+        for el in elements:
+            before.addprevious(el)
+        return elements
+
+    def _evaluate_iteration(self, context, child_cache, elements, allowed_styles=None, removals=None):
+        """
+        Evaluate the children for one item, in the body copy *elements*.
+        """
+        for child in self._bind_children(child_cache, elements):
+            child.evaluate(context,
+                           base=elements[0],
+                           allowed_styles=allowed_styles,
+                           removals=removals)
+
+    def evaluate(self, context, base=None, allowed_styles=None, removals=None):
         log.debug("Evaluating foreach %s %s", self.src, repr(self.start))
-        content_elements = None
         last_paragraph = self.end.start.getparent().getnext()
 
-        base = self.childs[0].field.start.getparent() if len(self.childs) > 0 else None
-        if base is not None:
-            root_xpath = self.childs[0].field.xpath_start.rsplit('/', 1)[0]
-        else:
-            root_xpath = None
-
-        if len(self.content()) == 0:
+        if len(self.content_range()) == 0:
             log.warning("Foreach with empty body: %s", self)
             return
 
-        child_cache = list(self._build_cache(root_xpath))
+        elements = self.content()
+        child_cache = list(self._build_cache(elements))
 
-        has_content = False
+        template = None
         for new_context in self.itervalues(context):
-            has_content = True
             log.debug('Using context %r', new_context)
 
-            if content_elements is None:
+            if template is None:
                 log.debug("Working with original elements")
-                content_elements = self.content()
-                base = base if base is not None else content_elements[0]
-                if not root_xpath:
-                    root_xpath = base.getroottree().getpath(base)
-                base_xpath = root_xpath
-                log.debug('Root: %s (%s)', root_xpath, base)
-                log.debug('Base: %s', base_xpath)
-                content_elements = self.copy()
+                template = self.copy()
             else:
                 log.debug("Working with cloned elements")
-                for i, el1 in enumerate(content_elements):
-                    el = deepcopy(el1)
-                    last_paragraph.addprevious(el)
-                    #last_paragraph.addnext(el)
-                    #last_paragraph = el
-                    if i == 0:
-                        base = el
-                        base_xpath = base.getroottree().getpath(base)
-                log.debug('Base: %s', base_xpath)
-
-            children = []
-            for cache, old_child in zip(child_cache, self.childs):
-                e_parent = cache['e_parent']
-                s_parent = cache['s_parent']
-
-                new_child = deepcopy(old_child)
-                new_child.field._base = base
-
-                # preserve xml tree connection (deepcopy makes a unlinked element)
-                new_child.field._parent = cache['parent']
-
-                new_child.field.xpath_start = make_abs(cache['field.xpath_start'], base_xpath)
-                new_child.field.xpath_end = make_abs(cache['field.xpath_end'], base_xpath)
-
-                if hasattr(new_child, 'start') and new_child.start != new_child.field:
-                    log.debug('Update start for %s', new_child)
-                    new_child.start._parent = s_parent
-                    new_child.start._base = base
-
-                    new_child.start.xpath_start = make_abs(cache['start.xpath_start'], base_xpath)
-                    new_child.start.xpath_end = make_abs(cache['start.xpath_end'], base_xpath)
-
-                if hasattr(new_child, 'end'):
-                    log.debug('Update end for %s', new_child)
-                    new_child.end._parent = e_parent
-                    new_child.end._base = base
-
-                    new_child.end.xpath_start = make_abs(cache['end.xpath_start'], base_xpath)
-                    new_child.end.xpath_end = make_abs(cache['end.xpath_end'], base_xpath)
-
-                children.append(new_child)
-
-            for child in children:
-                child.evaluate(new_context,
-                               base=base,
-                               allowed_styles=allowed_styles)
-        if not has_content:
+                elements = self._insert_copy(template, last_paragraph)
+            self._evaluate_iteration(new_context, child_cache, elements, allowed_styles, removals)
+        if template is None:
             self.remove_content()
 
+        self.remove_fields(removals)
+
+    def partial(self, constants, bound=frozenset(), allowed_styles=None, removals=None):
+        # the loop body is specialized once, before it is cloned per item
+        bound = bound | {self.dest, 'foreach'}
+        super(ForEach, self).partial(constants, bound, allowed_styles=allowed_styles, removals=removals)
+
+    def stream(self, context, allowed_styles=None):
+        """
+        Replace the loop body with a marker and return it together with a
+        generator, which renders one iteration at a time in front of the marker
+        and yields the elements of that iteration. The caller may detach them
+        once they are written.
+        """
+        log.debug("Streaming foreach %s %s", self.src, repr(self.start))
+        if len(self.content_range()) == 0:
+            log.warning("Foreach with empty body: %s", self)
+            return None, iter(())
+
+        child_cache = list(self._build_cache(self.content()))
+
+        template = self.copy()
+        self.remove_content()
+        marker = Comment('foreach')
+        self.end.start.getparent().addprevious(marker)
         self.remove_fields()
 
+        return marker, self._iterations(context, template, marker, child_cache, allowed_styles)
 
-def gen_tree(doc):
-    fields = []
-    for paragraph in doc.paragraphs:
-        fields += paragraph.fields()
+    def _iterations(self, context, template, marker, child_cache, allowed_styles):
+        for new_context in self.itervalues(context):
+            log.debug('Using context %r', new_context)
+            boundary = marker.getprevious()
+            elements = self._insert_copy(template, marker)
+
+            removals = Removals()
+            self._evaluate_iteration(new_context, child_cache, elements, allowed_styles, removals)
+            removals.apply()
+
+            output = []
+            el = boundary.getnext() if boundary is not None else marker.getparent()[0]
+            while el != marker:
+                output.append(el)
+                el = el.getnext()
+            yield output
+
+
+def _ancestor(element, tag):
+    while element is not None and element.tag != tag:
+        element = element.getparent()
+    return element
+
+
+def _table_rows(loop):
+    start_row = _ancestor(loop.start.start, qn('w:tr'))
+    end_row = _ancestor(loop.end.start, qn('w:tr'))
+    rows = list(start_row.itersiblings(qn('w:tr')))
+    return start_row, rows[:rows.index(end_row)], end_row
+
+
+class RowForEach(ForEach):
+    """
+    ForEach whose start and end field sit in two rows of the same table, with
+    only variables in the rows between them. Those rows are cloned as a whole
+    for each item and the variables are found again by their child offsets.
+    """
+    __slots__ = ()
+
+    @staticmethod
+    def applies(loop):
+        start_row = _ancestor(loop.start.start, qn('w:tr'))
+        end_row = _ancestor(loop.end.start, qn('w:tr'))
+        if start_row is None or end_row is None or start_row == end_row or \
+           start_row.getparent() != end_row.getparent():
+            return False
+
+        rows = _table_rows(loop)[1]
+        for child in loop.childs:
+            if type(child) is not Variable or \
+               _ancestor(child.field.start, qn('w:tr')) not in rows or \
+               _ancestor(child.field.end, qn('w:tr')) not in rows:
+                return False
+        return True
+
+    @classmethod
+    def from_foreach(cls, loop):
+        result = cls.__new__(cls)
+        for key in slot_names(ForEach):
+            if hasattr(loop, key):
+                setattr(result, key, getattr(loop, key))
+        return result
+
+    # noinspection PyProtectedMember
+    def evaluate(self, context, base=None, allowed_styles=None, removals=None):
+        log.debug("Evaluating row foreach %s %s", self.src, repr(self.start))
+        start_row, rows, end_row = _table_rows(self)
+
+        children = [(child,
+                     Location.of(rows, child.field.start),
+                     Location.of(rows, child.field.end),
+                     child.field._parent._parent)
+                    for child in self.childs]
+
+        template = [deepcopy(row) for row in rows]
+        for row in rows:
+            row.getparent().remove(row)
 
-    for table in doc.tables:
-        fields += table.fields()
+        for new_context in self.itervalues(context):
+            clones = [deepcopy(row) for row in template]
+            for row in clones:
+                end_row.addprevious(row)
+
+            # resolve all anchors first, filling a field changes its siblings
+            variables = []
+            for child, start, end, cell in children:
+                start, end = start.resolve(clones), end.resolve(clones)
+                field = child.field.bind(start, end, Paragraph(start.getparent(), cell))
+                variables.append(Variable(field, child.path))
+
+            for variable in variables:
+                variable.evaluate(new_context, allowed_styles=allowed_styles)
+
+        for field, row in ((self.start, start_row), (self.end, end_row)):
+            field.replace('')
+            if not ''.join(t.text or '' for t in row.iter(qn('w:t'))).strip():
+                row.getparent().remove(row)
+
+
+# noinspection PyProtectedMember
+def gen_tree(doc, normalize=False):
+    """
+    Evaluation tree of the fields in *doc*. With *normalize*, the runs of the
+    document are normalized first (see :mod:`docx_ext.normalize`), which
+    changes the document.
+    """
+    from . import init
+    init()
+
+    if normalize:
+        from .normalize import normalize as normalize_runs
+        normalize_runs(doc._document_part._element.body)
+
+    container = build_tree(doc.stories.fields())
+    container._document = doc
+    return container
 
-    for textboxes in doc.textboxes:
-        fields += textboxes.fields()
 
+def build_tree(fields):
     fields = [f for f in fields if f.code == 'MERGEFIELD' and f.extra]
 
     container = Container()
@@ -338,8 +917,12 @@ def gen_tree(doc):
                 container.parent.childs.append(container)
             elif cmd.startswith('end'):
                 container.end = f
+                if isinstance(container, ForEach) and RowForEach.applies(container):
+                    log.info("Foreach %s repeats table rows", container.src)
+                    container = RowForEach.from_foreach(container)
+                    container.parent.childs[-1] = container
                 log.debug("End found %s (in %s)", f, unicode(container))
-                log.debug("Has %d paragraphs", len(container.content()))
+                log.debug("Has %d paragraphs", len(container.content_range()))
                 container = container.parent
 
     if container.parent is not None:
@@ -348,3 +931,4 @@ def gen_tree(doc):
         raise ParserException(msg, container)
 
     return container
+
@@ -0,0 +1,159 @@
+# encoding: utf-8
+"""
+Parsed templates kept in memory. A render gets a copy of the pooled
+document with its own main document part; styles, numbering, headers,
+images and the other parts are shared with the pooled one and must not be
+changed (rendering only changes the document part and adds images).
+"""
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import os
+import threading
+from copy import deepcopy
+from io import BytesIO
+
+from docx import Document
+from docx.package import Package
+from docx.parts.document import DocumentPart
+
+from . import init
+from .package import iter_parts
+from .utils import Location
+
+
+__author__ = 'bluec0re'
+
+log = logging.getLogger(__name__)
+
+
+# noinspection PyProtectedMember
+def _copy_rels(source, target, replaced=None):
+    for rel in source.rels.values():
+        part = rel._target
+        if replaced is not None and part is replaced[0]:
+            part = replaced[1]
+        target.rels.add_relationship(rel.reltype, part, rel.rId, rel.is_external)
+
+
+# noinspection PyProtectedMember
+def clone(doc, source=None):
+    """
+    Copy of *doc* deep-copying only the document.xml element. *source* is
+    the package data the copy is saved against (see
+    :class:`docx_ext.package.PackageWriter`), the parts shared with *doc*
+    are copied from it as they are.
+    """
+    part = doc._document_part
+    package = doc._package
+
+    new_package = Package()
+    new_part = DocumentPart(part.partname, part.content_type, deepcopy(part._element), new_package)
+    _copy_rels(part, new_part)
+    _copy_rels(package, new_package, (part, new_part))
+    for image_part in package.image_parts:
+        new_package.image_parts.append(image_part)
+
+    copy = Document.__new__(Document)
+    copy._document_part = new_part
+    copy._package = new_package
+    copy._source = source if source is not None else doc._source
+    copy._shared = frozenset(p for p in iter_parts(package) if p is not part)
+    return copy
+
+
+def _fields(node):
+    """
+    Fields of the nodes below *node*, in a fixed order.
+    """
+    fields = []
+    for name in ('field', 'start', 'end'):
+        field = getattr(node, name, None)
+        if field is not None and field not in fields:
+            fields.append(field)
+    for child in getattr(node, 'childs', ()):
+        fields += _fields(child)
+    return fields
+
+
+# noinspection PyProtectedMember
+class PooledTree(object):
+    """
+    Evaluation tree of a pooled document together with the locations of the
+    elements its fields reference. :meth:`bind` returns a copy of the tree
+    for a :func:`clone` of the document without scanning it for fields.
+
+    Like for :class:`docx_ext.document.StoryIndex` of body elements, the
+    paragraphs of the bound fields are parented by the document body.
+    """
+
+    def __init__(self, doc):
+        from .parser import gen_tree
+
+        self.tree = gen_tree(doc, normalize=True)
+        body = [doc._document_part._element.body]
+        self._anchors = [(Location.of(body, field.start), Location.of(body, field.end),
+                          Location.of(body, field._parent._p))
+                         for field in _fields(self.tree)]
+
+    def bind(self, doc):
+        from docx.text import Paragraph
+
+        part = doc._document_part
+        body = [part._element.body]
+        parent = part.body
+        paragraphs = {}
+
+        tree = deepcopy(self.tree)
+        tree._document = doc
+        for field, (start, end, paragraph) in zip(_fields(tree), self._anchors):
+            key = (paragraph.index, paragraph.steps)
+            if key not in paragraphs:
+                paragraphs[key] = Paragraph(paragraph.resolve(body), parent)
+            field._parent = paragraphs[key]
+            field.anchor(start.resolve(body), end.resolve(body))
+        return tree
+
+
+class TemplatePool(object):
+    """
+    Parsed templates by path, re-read when their mtime changes. :meth:`get`
+    returns a copy to render, :meth:`get_tree` the copy and its evaluation
+    tree. Both are safe to call from several threads.
+
+    The pooled documents are normalized (see :mod:`docx_ext.normalize`) when
+    they are loaded.
+    """
+
+    def __init__(self):
+        self._templates = {}
+        self._lock = threading.Lock()
+
+    def _load(self, path):
+        mtime = os.path.getmtime(path)
+        with self._lock:
+            cached = self._templates.get(path)
+            if cached is None or cached[0] != mtime:
+                log.info("Loading template %s", path)
+                init()
+                with open(path, 'rb') as fp:
+                    data = fp.read()
+                doc = Document(BytesIO(data))
+                cached = self._templates[path] = (mtime, data, doc, PooledTree(doc))
+        return cached
+
+    def get(self, path):
+        _, data, doc, _ = self._load(path)
+        return clone(doc, BytesIO(data))
+
+    def get_tree(self, path):
+        """
+        Copy of the template and its evaluation tree bound to the copy.
+        """
+        _, data, doc, tree = self._load(path)
+        copy = clone(doc, BytesIO(data))
+        return copy, tree.bind(copy)
+
+    def discard(self, path):
+        with self._lock:
+            self._templates.pop(path, None)
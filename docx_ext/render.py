@@ -0,0 +1,44 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+import logging
+
+
+__author__ = 'bluec0re'
+
+log = logging.getLogger(__name__)
+
+
+def render(template, context, target, allowed_styles=None, session=None, tree=None, normalize=False):
+    """
+    Blocking render of *template* (a path, stream or a document, e.g. from
+    :class:`docx_ext.pool.TemplatePool`) with *context* into *target*. Each render has its own *session* (see
+    :class:`docx_ext.session.Session`) unless one is given. *tree* is the
+    evaluation tree of a document *template*, if it is known already,
+    otherwise it is built with the runs normalized if *normalize* is true.
+    """
+    # imported here, so the daemon and async front ends start quickly
+    from docx import Document
+
+    from . import init
+    from .memory import stage
+    from .parser import Context, gen_tree
+
+    init()
+    if not isinstance(context, Context):
+        context = Context(context, session=session)
+    elif session is not None:
+        context.session = session
+
+    with stage('load'):
+        doc = template if isinstance(template, Document) else Document(template)
+    if tree is None:
+        with stage('gen_tree'):
+            tree = gen_tree(doc, normalize=normalize)
+    if allowed_styles is None:
+        allowed_styles = doc.styles.keys()
+    try:
+        tree.evaluate(context, allowed_styles=allowed_styles)
+    finally:
+        with stage('save'):
+            doc.save(target)
@@ -0,0 +1,305 @@
+# encoding: utf-8
+"""
+Static analysis of the context paths a template uses.
+
+    python -m docx_ext.schema template.docx
+
+prints the minimal context schema as JSON: mappings for the used keys,
+one element lists for iterables and null for values. Paths of loop items
+are written with ``[]``, e.g. ``items[].name``.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import argparse
+import json
+import logging
+import re
+
+from .utils import Default
+
+
+__author__ = 'bluec0re'
+
+log = logging.getLogger(__name__)
+
+ITEM = '[]'
+
+
+def dotted(path):
+    """
+    >>> dotted(('items', ITEM, 'name'))
+    'items[].name'
+    """
+    return '.'.join(path).replace('.' + ITEM, ITEM)
+
+
+def bind(path, scope):
+    """
+    Context path of the dotted *path*, names bound by enclosing loops are
+    replaced by the items of their source. None for loop locals.
+
+    >>> bind('item.name', {'item': ('items', ITEM)})
+    ('items', '[]', 'name')
+    >>> bind('foreach.isLast', {'foreach': None}) is None
+    True
+    """
+    keys = tuple(path.split('.')) if not isinstance(path, tuple) else path
+    if keys[0] in scope:
+        if scope[keys[0]] is None:
+            return None
+        return scope[keys[0]] + keys[1:]
+    return keys
+
+
+class Reference(Default):
+    """
+    A context path used by a template. *kind* is ``variable``, ``if`` or
+    ``foreach``, *loops* the sources of the enclosing loops.
+    """
+    __slots__ = ('path', 'kind', 'loops')
+
+    def __init__(self, path, kind, loops=()):
+        super(Reference, self).__init__()
+        self.path = path
+        self.kind = kind
+        self.loops = loops
+
+    @property
+    def name(self):
+        return dotted(self.path)
+
+
+class Schema(Default):
+    """
+    The references of a template, merged into a tree of the used keys.
+    """
+    __slots__ = ('references', '_tree', '_values')
+
+    def __init__(self):
+        super(Schema, self).__init__()
+        self.references = []
+        self._tree = {}
+        # paths whose value is used as a whole, by variables and ifs
+        self._values = set()
+
+    def add(self, path, kind, loops=()):
+        self.references.append(Reference(path, kind, loops))
+        if kind != 'foreach':
+            self._values.add(tuple(path))
+        node = self._tree
+        for key in path:
+            node = node.setdefault(key, {})
+        if kind == 'foreach':
+            node.setdefault(ITEM, {})
+
+    def paths(self):
+        return sorted(set(ref.name for ref in self.references))
+
+    def iterables(self):
+        return sorted(set(ref.name for ref in self.references if ref.kind == 'foreach'))
+
+    def as_dict(self):
+        """
+        >>> schema = Schema()
+        >>> schema.add(('items',), 'foreach')
+        >>> schema.add(('items', ITEM, 'name'), 'variable', (('items',),))
+        >>> schema.add(('author',), 'variable')
+        >>> schema.as_dict() == {'author': None, 'items': [{'name': None}]}
+        True
+        """
+        def convert(node):
+            if not node:
+                return None
+            if ITEM in node:
+                return [convert(node[ITEM])]
+            return {key: convert(child) for key, child in node.items()}
+        return convert(self._tree) or {}
+
+    def prune(self, variables):
+        """
+        Copy of the context *variables* reduced to the used keys. Values used
+        as a whole are kept completely, even if some of their keys are used
+        as well. Providers are kept as they are, so they are still only
+        called when needed.
+
+        >>> schema = Schema()
+        >>> schema.add(('items',), 'foreach')
+        >>> schema.add(('items', ITEM, 'name'), 'variable')
+        >>> schema.prune({'items': [{'name': 'a', 'blob': 'x'}], 'unused': 1})
+        {'items': [{'name': 'a'}]}
+        """
+        from .parser import Columns, is_provider
+
+        def prune(value, node, path=()):
+            if not node or path in self._values or is_provider(value):
+                return value
+            if ITEM in node:
+                item = path + (ITEM,)
+                if isinstance(value, Columns):
+                    return Columns({name: column for name, column in value.columns.items()
+                                    if name in node[ITEM] or not node[ITEM] or item in self._values})
+                if isinstance(value, (list, tuple)):
+                    return [prune(v, node[ITEM], item) for v in value]
+                return value
+            if isinstance(value, dict):
+                return {key: prune(value[key], child, path + (key,)) for key, child in node.items() if key in value}
+            return value
+
+        return prune(variables, self._tree)
+
+
+def _visit(node, schema, scope, loops):
+    from .parser import ForEach, If, Variable
+
+    if isinstance(node, Variable):
+        path = bind(node.path, scope)
+        if path is not None:
+            schema.add(path, 'variable', loops)
+    elif isinstance(node, If):
+        # the same lookups as If.test
+        for name in re.findall(r'\$(\S+)', node.src):
+            path = bind(name, scope)
+            if path is not None:
+                schema.add(path, 'if', loops)
+
+    if isinstance(node, ForEach):
+        src = bind(node.src, scope)
+        if src is None:
+            return
+        schema.add(src, 'foreach', loops)
+        scope = dict(scope, foreach=None)
+        scope[node.dest] = src + (ITEM,)
+        loops += (src,)
+
+    for child in getattr(node, 'childs', ()):
+        _visit(child, schema, scope, loops)
+
+
+def analyze(tree):
+    """
+    Schema of the paths used by the nodes of *tree* (see
+    :func:`docx_ext.parser.gen_tree`).
+    """
+    schema = Schema()
+    _visit(tree, schema, {}, ())
+    log.debug("%d references, %d iterables", len(schema.references), len(schema.iterables()))
+    return schema
+
+
+def _expression(node, scope):
+    """
+    Path of a jinja attribute or constant item lookup chain, the unresolved
+    rest of the chain.
+    """
+    from jinja2 import nodes
+
+    keys = []
+    while True:
+        if isinstance(node, nodes.Getattr):
+            keys.insert(0, node.attr)
+        elif isinstance(node, nodes.Getitem) and isinstance(node.arg, nodes.Const):
+            keys.insert(0, str(node.arg.value))
+        else:
+            break
+        node = node.node
+    if isinstance(node, nodes.Name):
+        return bind((node.name,) + tuple(keys), scope), None
+    return None, node
+
+
+def _visit_jinja(node, schema, scope, loops, kind='variable'):
+    from jinja2 import nodes
+
+    if isinstance(node, nodes.For):
+        src, rest = _expression(node.iter, scope)
+        if rest is not None:
+            # e.g. dict.items(), the loop target is no context item
+            _visit_jinja(rest, schema, scope, loops)
+        elif src is not None:
+            schema.add(src, 'foreach', loops)
+        inner = dict(scope, loop=None)
+        targets = [node.target] if isinstance(node.target, nodes.Name) else node.target.find_all(nodes.Name)
+        for target in targets:
+            inner[target.name] = src + (ITEM,) if src is not None and rest is None else None
+        inner_loops = loops + (src,) if src is not None and rest is None else loops
+        for child in node.body:
+            _visit_jinja(child, schema, inner, inner_loops)
+        if node.test is not None:
+            _visit_jinja(node.test, schema, inner, inner_loops, 'if')
+        for child in node.else_:
+            _visit_jinja(child, schema, scope, loops)
+        return
+
+    if isinstance(node, (nodes.If, nodes.CondExpr)):
+        _visit_jinja(node.test, schema, scope, loops, 'if')
+        for child in node.iter_child_nodes(exclude=('test',)):
+            _visit_jinja(child, schema, scope, loops, kind)
+        return
+
+    if isinstance(node, nodes.Call) and isinstance(node.node, nodes.Getattr):
+        # method of a context value, e.g. dict.items()
+        _visit_jinja(node.node.node, schema, scope, loops, kind)
+        for child in node.iter_child_nodes(exclude=('node',)):
+            _visit_jinja(child, schema, scope, loops, kind)
+        return
+
+    if isinstance(node, (nodes.Assign, nodes.Macro)):
+        # names set in the template are no context paths
+        for target in node.find_all(nodes.Name):
+            if target.ctx in ('store', 'param'):
+                scope[target.name] = None
+
+    if isinstance(node, (nodes.Name, nodes.Getattr, nodes.Getitem)):
+        path, rest = _expression(node, scope)
+        if rest is None:
+            if path is not None and node.ctx == 'load':
+                schema.add(path, kind, loops)
+        elif isinstance(rest, nodes.Getitem):
+            # dynamic key, only the operands are known
+            _visit_jinja(rest.arg, schema, scope, loops, kind)
+            _visit_jinja(rest.node, schema, scope, loops, kind)
+        else:
+            _visit_jinja(rest, schema, scope, loops, kind)
+        return
+
+    for child in node.iter_child_nodes():
+        _visit_jinja(child, schema, scope, loops, kind)
+
+
+def analyze_jinja(source):
+    """
+    Schema of the paths used by the (preprocessed) jinja template *source*.
+    """
+    import jinja2
+
+    env = jinja2.Environment()
+    schema = Schema()
+    # range, dict and the other globals are no context paths
+    _visit_jinja(env.parse(source), schema, dict.fromkeys(env.globals), ())
+    return schema
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Print the context schema of a template')
+    parser.add_argument('template')
+    parser.add_argument('--paths', action='store_true', help='list the used paths instead')
+    args = parser.parse_args()
+
+    from docx import Document
+
+    from . import init
+    from .parser import gen_tree
+
+    init()
+    schema = analyze(gen_tree(Document(args.template)))
+    if args.paths:
+        iterables = schema.iterables()
+        for path in schema.paths():
+            print(path + (' (iterable)' if path in iterables else ''))
+    else:
+        print(json.dumps(schema.as_dict(), indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level='WARNING')
+    main()
@@ -0,0 +1,76 @@
+# encoding: utf-8
+"""
+Serialization of a document element one body child at a time, for writing
+documents whose body is never held in memory as a whole.
+
+Only lxml is used, so the jinja front end can use it without docx.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import logging
+from copy import deepcopy
+
+from lxml import etree
+
+
+__author__ = 'bluec0re'
+
+log = logging.getLogger(__name__)
+
+MARK = 'docx_ext-split'
+
+
+def _split(element):
+    return etree.tostring(element, encoding='utf-8', xml_declaration=True,
+                          standalone=True).split(('<!--%s-->' % MARK).encode('utf-8'))
+
+
+def split_document(root, body):
+    """
+    Serialized document element *root* around the content of *body*, as
+    (head, tail).
+
+    >>> root = etree.XML('<document xmlns="urn:w"><body><p/></body><x/></document>')
+    >>> split_document(root, root[0])[1]
+    b'</body><x/></document>'
+    """
+    shell = etree.Element(root.tag, dict(root.attrib), nsmap=root.nsmap)
+    for child in root:
+        if child == body:
+            etree.SubElement(shell, body.tag, dict(body.attrib)).append(etree.Comment(MARK))
+        else:
+            shell.append(deepcopy(child))
+    return tuple(_split(shell))
+
+
+def serialize(root, elements, detach=False):
+    """
+    Serialized *elements* of the document element *root*, without the
+    namespace declarations made on *root*. They are moved into an empty copy
+    of *root* for it, and back to their places unless *detach* is true.
+
+    >>> root = etree.XML('<w:document xmlns:w="urn:w"><w:body><w:p/><w:p/></w:body></w:document>')
+    >>> serialize(root, list(root[0]))
+    b'<w:p/><w:p/>'
+    >>> len(root[0])
+    2
+    """
+    places = []
+    if not detach:
+        for el in elements:
+            place = etree.Comment(MARK)
+            el.addprevious(place)
+            places.append(place)
+
+    shell = etree.Element(root.tag, nsmap=root.nsmap)
+    shell.append(etree.Comment(MARK))
+    shell.extend(elements)
+    shell.append(etree.Comment(MARK))
+    # copies of elements repeat the declarations in scope of the original
+    etree.cleanup_namespaces(shell, top_nsmap=root.nsmap)
+    data = _split(shell)[1]
+
+    for place, el in zip(places, elements):
+        place.addnext(el)
+        place.getparent().remove(place)
+    return data
@@ -0,0 +1,52 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+import logging
+from io import BytesIO
+
+from .utils import Default
+
+
+__author__ = 'bluec0re'
+
+log = logging.getLogger(__name__)
+
+
+class Session(Default):
+    """
+    State of one render: the image factories and the caches. Every root
+    :class:`docx_ext.parser.Context` gets its own session, so documents can
+    be rendered in parallel threads without sharing mutable state.
+
+    *image_factories* defaults to the globally registered factories at the
+    time the session is created.
+    """
+    __slots__ = ('image_factories', '_png')
+
+    def __init__(self, image_factories=None):
+        super(Session, self).__init__()
+        if image_factories is None:
+            from .fields import registered_image_factories
+            image_factories = registered_image_factories()
+        self.image_factories = tuple(image_factories)
+        self._png = {}
+
+    def image(self, path):
+        """
+        Image for the *path* of an HTML img tag, None if no factory knows it.
+        """
+        for factory in self.image_factories:
+            img = factory(path)
+            if img is not None:
+                return img
+
+    def png(self, img):
+        """
+        *img* encoded as PNG, once per image object and session.
+        """
+        # the image is kept, so its id stays unique
+        if id(img) not in self._png:
+            io = BytesIO()
+            img.save(io, 'PNG')
+            self._png[id(img)] = (img, io.getvalue())
+        return BytesIO(self._png[id(img)][1])
@@ -0,0 +1,196 @@
+# encoding: utf-8
+"""
+Sharded rendering of large top level loops: the items are split into chunks,
+which worker processes render into detached XML fragments. The fragments are
+spliced into the document in order.
+
+The workers get the document.xml of the document (as it is in memory) and
+the context without the sharded loop sources once, then only the chunks of
+items. The context has to be picklable (no providers).
+"""
+from __future__ import absolute_import, unicode_literals
+
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+
+from docx import Document
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.oxml import parse_xml
+from docx.oxml.ns import qn
+from lxml import etree
+
+from . import init
+from .parser import Chunk, Columns, Context, ForEach, gen_tree
+
+
+__author__ = 'bluec0re'
+
+log = logging.getLogger(__name__)
+
+
+def _with_value(variables, path, value):
+    """
+    Copy of *variables* with *value* at the dotted *path*, only the dicts
+    along the path are copied.
+
+    >>> v = {'a': {'b': 1, 'c': 2}, 'd': 3}
+    >>> _with_value(v, 'a.b', 5) == {'a': {'b': 5, 'c': 2}, 'd': 3}, v['a']['b']
+    (True, 1)
+    """
+    head, _, rest = path.partition('.')
+    result = dict(variables)
+    if rest:
+        result[head] = _with_value(variables.get(head) or {}, rest, value)
+    else:
+        result[head] = value
+    return result
+
+
+def _chunks(src, size):
+    if isinstance(src, Columns):
+        total = len(src)
+        for offset in range(0, total, size):
+            yield Chunk(Columns({name: column[offset:offset + size] for name, column in src.columns.items()}),
+                        offset, total)
+        return
+
+    for offset in range(0, len(src), size):
+        yield Chunk(src[offset:offset + size], offset, len(src))
+
+
+def _length(src):
+    """
+    Number of items of a loop source, None if it cannot be sliced.
+    """
+    if isinstance(src, Columns):
+        return len(src)
+    if hasattr(src, '__len__') and hasattr(src, '__getitem__') and not isinstance(src, dict):
+        return len(src)
+    return None
+
+
+# state of a worker process, set up by _init_worker
+_worker = {}
+
+
+def _init_worker(document, variables, allowed_styles):
+    init()
+    _worker['document'] = document
+    _worker['variables'] = variables
+    _worker['allowed_styles'] = allowed_styles
+
+
+# noinspection PyProtectedMember
+def _render_chunk(index, path, chunk):
+    """
+    Render the loop at *index* of the template's top level nodes over the
+    *chunk* of its source at *path*. Returns the serialized fragment and the
+    blobs of images it references by their relationship ids.
+    """
+    # the default package holds the images, only the document part is used
+    doc = Document()
+    part = doc._document_part
+    part._element = parse_xml(_worker['document'])
+    known = set(part._rels.keys())
+
+    loop = gen_tree(doc).childs[index]
+    context = Context(_with_value(_worker['variables'], path, chunk))
+    _, iterations = loop.stream(context, allowed_styles=_worker['allowed_styles'])
+    fragment = etree.Element(qn('w:body'), nsmap=part._element.nsmap)
+    for elements in iterations:
+        # moving them out keeps the worker's document small
+        fragment.extend(elements)
+
+    images = {rId: rel.target_part.blob for rId, rel in part._rels.items()
+              if rId not in known and rel.reltype == RT.IMAGE}
+    return etree.tostring(fragment, encoding='utf-8'), images
+
+
+class _Splicer(object):
+    """
+    Inserts fragments in front of a loop marker, re-relating their images to
+    the document and numbering their drawings after the existing ones.
+    """
+
+    # noinspection PyProtectedMember
+    def __init__(self, doc):
+        self.part = doc._document_part
+        self._next_id = None
+
+    def splice(self, marker, data, images):
+        fragment = etree.fromstring(data)
+
+        rids = {}
+        for rId, blob in images.items():
+            rids[rId] = self.part.get_or_add_image_part(BytesIO(blob))[1]
+        if rids:
+            for blip in fragment.iter(qn('a:blip')):
+                rId = blip.get(qn('r:embed'))
+                if rId in rids:
+                    blip.set(qn('r:embed'), rids[rId])
+
+        drawings = list(fragment.iter(qn('wp:docPr')))
+        if drawings:
+            if self._next_id is None:
+                self._next_id = self.part.next_id
+            for drawing in drawings:
+                drawing.set('id', str(self._next_id))
+                self._next_id += 1
+
+        for el in list(fragment):
+            marker.addprevious(el)
+
+
+def render_sharded(doc, context, target, chunk_size=10000, workers=None, allowed_styles=None):
+    """
+    Render *doc* with *context* and save it to *target*. Top level loops over
+    more than *chunk_size* items (lists, tuples or columns; other iterables
+    are not split) are rendered in chunks by up to *workers* processes,
+    everything else is evaluated here.
+    """
+    init()
+    if not isinstance(context, Context):
+        context = Context(context)
+    if allowed_styles is None:
+        allowed_styles = doc.styles.keys()
+
+    tree = gen_tree(doc)
+    sources = {}
+    for index, child in enumerate(tree.childs):
+        if type(child) is ForEach:
+            src = context.resolve(child.src)
+            length = _length(src)
+            if length is not None and length > chunk_size:
+                sources[index] = src
+
+    # the workers render from the document before anything is evaluated
+    document = etree.tostring(doc._document_part._element) if sources else None
+
+    shards = []
+    for index, child in enumerate(tree.childs):
+        if index in sources:
+            marker, _ = child.stream(context, allowed_styles=allowed_styles)
+            if marker is not None:
+                shards.append((index, child.src, sources[index], marker))
+            continue
+        child.evaluate(context, allowed_styles=allowed_styles)
+
+    if shards:
+        variables = context.variables
+        for _, path, _, _ in shards:
+            variables = _with_value(variables, path, None)
+        splicer = _Splicer(doc)
+        workers = workers or os.cpu_count() or 1
+        with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker,
+                                 initargs=(document, variables, list(allowed_styles))) as pool:
+            for index, path, src, marker in shards:
+                futures = [pool.submit(_render_chunk, index, path, chunk) for chunk in _chunks(src, chunk_size)]
+                log.info("Rendering loop over %s in %d chunks", path, len(futures))
+                for future in futures:
+                    splicer.splice(marker, *future.result())
+                marker.getparent().remove(marker)
+        doc.invalidate_stories()
+
+    doc.save(target)
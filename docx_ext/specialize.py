@@ -0,0 +1,52 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+import logging
+from io import BytesIO
+
+from . import init
+from .parser import Context, gen_tree
+from .render import render
+from .utils import Default
+
+
+__author__ = 'bluec0re'
+
+log = logging.getLogger(__name__)
+
+
+class SpecializedTemplate(Default):
+    """
+    Template pre-evaluated against the values shared by a whole batch. The
+    fields and conditions depending only on *constants* are filled in once,
+    rendering a document only evaluates the remaining ones.
+
+    The per-document contexts must not redefine the constant names.
+    """
+    __slots__ = ('template', 'constants', 'allowed_styles')
+
+    # noinspection PyProtectedMember
+    def __init__(self, template, constants, allowed_styles=None):
+        super(SpecializedTemplate, self).__init__()
+        from docx import Document
+
+        init()
+        self.constants = constants.variables if isinstance(constants, Context) else constants
+        doc = Document(template)
+        if allowed_styles is None:
+            allowed_styles = doc.styles.keys()
+        self.allowed_styles = allowed_styles
+
+        gen_tree(doc).partial(Context(self.constants), allowed_styles=allowed_styles)
+        io = BytesIO()
+        doc.save(io)
+        self.template = io.getvalue()
+        log.debug("Specialized template: %d bytes", len(self.template))
+
+    def render(self, context, target):
+        if isinstance(context, Context):
+            context = context.variables
+        # loops over constant sources still need them
+        variables = dict(self.constants)
+        variables.update(context)
+        render(BytesIO(self.template), variables, target, allowed_styles=self.allowed_styles)
@@ -0,0 +1,72 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+import logging
+
+from docx.oxml.ns import qn
+
+from . import init
+from .package import PackageWriter
+from .parser import Context, ForEach, gen_tree
+from .serialize import serialize, split_document
+
+
+__author__ = 'bluec0re'
+
+log = logging.getLogger(__name__)
+
+
+def write_document(root, streams, fp):
+    """
+    Serialize the document element *root* into *fp*. Markers in the body,
+    which are keys of *streams*, are replaced by the elements their
+    iterations yield; those are removed from the tree once written.
+    """
+    body = root.find(qn('w:body'))
+    head, tail = split_document(root, body)
+
+    fp.write(head)
+    for el in list(body):
+        if el in streams:
+            for elements in streams[el]:
+                fp.write(serialize(root, elements, detach=True))
+        else:
+            fp.write(serialize(root, [el]))
+    fp.write(tail)
+
+
+# noinspection PyProtectedMember
+def save_streaming(doc, context, target, allowed_styles=None):
+    """
+    Render *doc* with *context* and save it to *target*. Top level loops are
+    rendered one iteration at a time directly into the ``document.xml`` zip
+    entry, so memory does not grow with the number of items.
+    """
+    init()
+    if not isinstance(context, Context):
+        context = Context(context)
+    if allowed_styles is None:
+        allowed_styles = doc.styles.keys()
+
+    streams = {}
+    for child in gen_tree(doc).childs:
+        # table rows are rendered in place, the table is one body element
+        if type(child) is ForEach:
+            marker, iterations = child.stream(context, allowed_styles=allowed_styles)
+            if marker is not None:
+                streams[marker] = iterations
+        else:
+            child.evaluate(context, allowed_styles=allowed_styles)
+
+    document_part = doc._document_part
+    with PackageWriter(target, getattr(doc, '_source', None)) as writer:
+        with writer.open(document_part.partname.membername) as fp:
+            write_document(document_part._element, streams, fp)
+
+        for marker in streams:
+            marker.getparent().remove(marker)
+        doc.invalidate_stories()
+
+        # images may have been added while streaming, so everything else
+        # is written afterwards
+        writer.write_package(doc._package, skip=(document_part,))
@@ -2,7 +2,7 @@
 from __future__ import absolute_import, unicode_literals
 from docx.oxml import register_element_cls, CT_RPr
 from docx.oxml.xmlchemy import ZeroOrOne, BaseOxmlElement, ZeroOrMore
-from docx.shared import Parented
+from docx.shared import Parented, lazyproperty
 from docx.table import Table
 from docx.text import Paragraph
 from docx.oxml.ns import nsmap
@@ -31,10 +31,10 @@ class Textbox(Parented):
         super(Textbox, self).__init__(parent)
         self._tb = element
 
-    @property
+    @lazyproperty
     def paragraphs(self):
         return [Paragraph(parent=self, p=p) for p in self._tb.p_lst]
 
-    @property
+    @lazyproperty
     def tables(self):
         return [Table(parent=self, tbl=t) for t in self._tb.tbl_lst]
@@ -1,20 +1,32 @@
 # encoding: utf-8
 from __future__ import absolute_import, unicode_literals
 
-import re
 import logging
-import os
 
 __author__ = 'bluec0re'
 
 log = logging.getLogger(__name__)
 
 
+def slot_names(cls):
+    names = []
+    for klass in reversed(cls.__mro__):
+        for name in klass.__dict__.get('__slots__', ()):
+            if name not in names:
+                names.append(name)
+    return names
+
+
 class Default(object):
+    __slots__ = ()
+
+    def _public_attributes(self):
+        keys = slot_names(type(self)) + list(getattr(self, '__dict__', ()))
+        return [key for key in keys if not key.startswith('_') and hasattr(self, key)]
+
     def __repr__(self):
         attrs = ', '.join(
-                    '%s=%s' % (key, repr(getattr(self, key))) for key in self.__dict__
-                    if not key.startswith('_'))
+                    '%s=%s' % (key, repr(getattr(self, key))) for key in self._public_attributes())
         return '{}({})'.format(type(self).__name__, attrs)
 
     def __str__(self):
@@ -28,58 +40,50 @@ class Default(object):
     def __eq__(self, other):
         try:
             return all(getattr(self, key) == getattr(other, key)
-                       for key in self.__dict__ if not key.startswith('_'))
+                       for key in self._public_attributes())
         except AttributeError:
             return False
 
 
-def make_relative(path, start):
-    log.debug('%s - %s', path, start)
-    if path == start or start is None:
-        result = './'
-    else:
-        newpath = os.path.relpath(path, start)
-        if newpath.startswith('../'):
-            m = re.search(r'\.\./([^/]+)\[(\d+)\]', newpath)
-
-            tag = m.group(1)
-            newoffset = int(m.group(2))
-            m = re.search(r'/%s\[(\d+)\]' % re.escape(tag), start)
-
-            oldoffset = int(m.group(1))
-            result = newpath.replace('../%s[%d]' % (tag, newoffset), '../%s[%d]' % (tag, newoffset - oldoffset))
-        else:
-            result = './' + newpath
-    log.debug(' => %s', result)
-    return result
-
-
-def make_abs(path, root):
-    log.debug('%s + %s', path, root)
-    if path == './':
-        result = root
-    elif path.startswith('./'):
-        result = root + '/' + path[2:]
-    elif path.startswith('../'):
-        m = re.search('\.\./([^/]+)\[(-?\d+)\]', path)
-        tag = m.group(1)
-        offset = int(m.group(2))
-        path = path.replace(m.group(0), '')
-        while path.startswith('../'):
-            root = root.rsplit('/', 1)[0]
-            path = path[3:]
-        if offset > 0:
-            if tag in root:
-                result = root + '/following-sibling::%s[%d]' % (tag, offset) + path
-            else:
-                result = root + '/%s[%d]' % (tag, offset) + path
-        else:
-            m = re.search(r'%s\[(\d+)\]' % re.escape(tag), root)
-            oldoffset = int(m.group(1))
-            newoffset = oldoffset + offset
-            result = root.replace(m.group(0), '') + ('%s[%d]' % (tag, newoffset)) + path
-    else:
-        result = root + '/' + path
-
-    log.debug(' => %s', result)
-    return result
+class Location(Default):
+    """
+    Position of an element inside a list of sibling *elements*: the index of
+    the one containing it, then the child indices down to it. Resolving it
+    against copies of the elements finds the copy of the element.
+
+    >>> from lxml import etree
+    >>> body = etree.XML('<body><p><r/><r><t/></r></p><p/></body>')
+    >>> location = Location.of(list(body), body[0][1][0])
+    >>> location
+    Location(index=0, steps=(1, 0))
+    >>> location.xpath(list(etree.XML(etree.tostring(body))))
+    '/body/p[1]/r[2]/t'
+    """
+    __slots__ = ('index', 'steps')
+
+    def __init__(self, index, steps=()):
+        super(Location, self).__init__()
+        self.index = index
+        self.steps = tuple(steps)
+
+    @classmethod
+    def of(cls, elements, element):
+        steps = []
+        while element not in elements:
+            parent = element.getparent()
+            steps.append(parent.index(element))
+            element = parent
+        return cls(elements.index(element), reversed(steps))
+
+    def resolve(self, elements):
+        element = elements[self.index]
+        for i in self.steps:
+            element = element[i]
+        return element
+
+    def xpath(self, elements):
+        """
+        XPath of the resolved element, for debugging.
+        """
+        element = self.resolve(elements)
+        return element.getroottree().getpath(element)
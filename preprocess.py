@@ -3,12 +3,19 @@ import shlex
 
 __author__ = 'bluec0re'
 
+# bump on every change of the produced output, it invalidates cached templates
+__version__ = '0.2'
+
+import os
+import tempfile
 import zipfile
 import sys
 from lxml import etree
 import logging
 import re
 
+from docx_ext.normalize import normalize
+
 log = logging.getLogger(__name__)
 
 
@@ -46,6 +53,17 @@ def main():
                                                                 standalone=True))
 
 
+def debug_dir(debug):
+    """
+    Directory for the debug files of one run: *debug* if it is a path, else
+    a new temporary directory, so parallel runs never share files.
+    """
+    if debug is True:
+        debug = tempfile.mkdtemp(prefix='docx_templating-')
+        log.info("Writing debug files to %s", debug)
+    return debug
+
+
 def parse_field(field):
     lex = shlex.shlex(field, posix=True)
     lex.whitespace_split = True
@@ -184,13 +202,15 @@ def preprocess(document, debug=False):
         document = document.read()
 
     if debug:
-        with open('orig.xml', 'w') as fp:
+        debug = debug_dir(debug)
+        with open(os.path.join(debug, 'orig.xml'), 'wb') as fp:
             fp.write(document)
 
     doc = etree.XML(document)
+    normalize(doc)
 
     if debug:
-        with open('parsed.xml', 'w') as fp:
+        with open(os.path.join(debug, 'parsed.xml'), 'wb') as fp:
             fp.write(etree.tostring(doc,
                                     encoding='utf-8',
                                     pretty_print=True,
@@ -204,7 +224,7 @@ def preprocess(document, debug=False):
     parse_simple_fields(doc)
 
     if debug:
-        with open('new.xml', 'w') as fp:
+        with open(os.path.join(debug, 'new.xml'), 'wb') as fp:
             fp.write(etree.tostring(doc,
                                     encoding='utf-8',
                                     pretty_print=True,
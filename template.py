@@ -1,14 +1,22 @@
 from __future__ import absolute_import, print_function, unicode_literals
 
-import jinja2
-from lxml import etree, html
-from lxml.html import clean
+from lxml import etree
+import argparse
+import hashlib
 import logging
+import os
+import tempfile
 import sys
+import time
 import zipfile
+from io import BytesIO
+from docx_ext.package import PackageWriter
+from docx_ext.serialize import serialize, split_document
+from docx_ext import normalize
+import preprocess as preprocessor
 from preprocess import preprocess
 import json
-from cgi import escape
+from html import escape
 
 
 __author__ = 'bluec0re'
@@ -36,7 +44,7 @@ def transform_html(root, init=False, default_style=None):
         result += '</w:p>'
         result += '<w:p><w:pPr>'
         if style:
-            result += '<w:pStyle w:val="%s"/>' % escape(style)
+            result += '<w:pStyle w:val="%s"/>' % escape(style, quote=True)
         if root.tag == 'li':
             result += '<w:numPr><w:ilvl w:val="0"/><w:numId w:val="5"/></w:numPr>'
         result += '<w:rPr></w:rPr>'
@@ -49,13 +57,13 @@ def transform_html(root, init=False, default_style=None):
         result += '</w:rPr><w:t>'
 
     if root.text is not None:
-        result += escape(root.text).strip()
+        result += escape(root.text, quote=False).strip()
 
     for child in root.getchildren():
         result += transform_html(child, default_style=style)
 
     if root.tail is not None:
-        result += escape(root.tail).strip()
+        result += escape(root.tail, quote=False).strip()
     return result
 
 
@@ -67,8 +75,15 @@ def preprocess_html(context):
     elif isinstance(context, list):
         return [preprocess_html(v) for v in context]
     elif isinstance(context, tuple):
-        return (preprocess_html(v) for v in context)
-    elif isinstance(context, (str, unicode)):
+        return tuple(preprocess_html(v) for v in context)
+    elif isinstance(context, str):
+        if not context.strip():
+            # lxml does not parse empty documents
+            return context
+
+        from lxml import html
+        from lxml.html import clean
+
         # clean html first
         cleaner = clean.Cleaner()
         cleaner.safe_attrs_only = True
@@ -85,64 +100,267 @@ def preprocess_html(context):
         else:
             # remove enclosing tag
             roottag = h.tag
-            value = etree.tostring(h)
+            value = etree.tostring(h, encoding='unicode')
             value = value[len(roottag) + 2:-(len(roottag)+3)]
         return value
     else:
         return context
 
 
-def render(doc, context, debug=False):
+def compile_template(doc):
+    import jinja2
+
     if isinstance(doc, etree._Element):
         doc = etree.tostring(doc,
                              encoding='utf-8',
                              xml_declaration=True,
                              standalone=True).decode('utf-8')
+    return jinja2.Template(doc)
+
 
-    template = jinja2.Template(doc)
+def render(doc, context, debug=False, template=None):
+    if template is None:
+        template = compile_template(doc)
     context = preprocess_html(context)
     if debug:
         doc = template.render(**context).encode('utf-8')
-        with open('templated.xml', 'w') as fp:
+        with open(os.path.join(preprocessor.debug_dir(debug), 'templated.xml'), 'wb') as fp:
             fp.write(doc)
         doc = etree.XML(doc)
     else:
         doc = etree.XML(template.render(**context).encode('utf-8'))
 
+    cleanup_controls(doc)
+
+    return etree.tostring(doc,
+                          encoding='utf-8',
+                          xml_declaration=True,
+                          standalone=True)
+
+
+def cleanup_controls(root):
     # cleanup control nodes
-    for el in doc.xpath('//*[@is_control="true"]'):
+    for el in root.xpath('.//*[@is_control="true"]'):
         par = el.getparent()
         par.remove(el)
         if par.find('w:r/w:t', par.nsmap) is None:
             par.getparent().remove(par)
 
-    return etree.tostring(doc,
-                          encoding='utf-8',
-                          xml_declaration=True,
-                          standalone=True)
 
+def render_stream(doc, context, fp):
+    """
+    Like render, but writes each body element to *fp* as soon as the template
+    has produced it, so the rendered document is never held in memory.
+    """
+    template = compile_template(doc)
+    context = preprocess_html(context)
+
+    parser = etree.XMLPullParser(events=('start', 'end'))
+    root = body = None
+    for chunk in template.generate(**context):
+        parser.feed(chunk.encode('utf-8'))
+        for event, el in parser.read_events():
+            if event == 'start' and root is None:
+                root = el
+            elif event == 'start' and body is None and el.getparent() is root and \
+                    etree.QName(el).localname == 'body':
+                body = el
+                fp.write(split_document(root, body)[0])
+            elif event == 'end' and body is not None and el.getparent() is body:
+                cleanup_controls(el)
+                if el.getparent() is not None:
+                    fp.write(serialize(root, [el], detach=True))
+    parser.close()
+
+    fp.write(split_document(root, body)[1])
+
+
+def cache_dir():
+    return os.environ.get('DOCX_TEMPLATE_CACHE') or \
+        os.path.join(os.environ.get('XDG_CACHE_HOME') or os.path.expanduser('~/.cache'), 'docx_templating')
 
-def main(preproc=True):
+
+def preprocessed(zipin, debug=False, cache=True):
+    """
+    The preprocessed document.xml of *zipin*. Results are kept in the cache
+    directory, keyed by a hash of the document and the versions of the
+    preprocessor and the run normalizer.
+    """
+    document = zipin.read('word/document.xml')
+    path = None
+    if cache:
+        version = '%s/%s' % (preprocessor.__version__, normalize.__version__)
+        key = hashlib.sha256(version.encode('utf-8') + b'\0' + document).hexdigest()
+        path = os.path.join(cache_dir(), key + '.xml')
+        try:
+            with open(path, 'rb') as fp:
+                log.debug("Using cached template %s", path)
+                return fp.read().decode('utf-8')
+        except (IOError, OSError):
+            pass
+
+    doc = etree.tostring(preprocess(document, debug=debug),
+                         encoding='utf-8',
+                         xml_declaration=True,
+                         standalone=True)
+
+    if path is not None:
+        tmp = None
+        try:
+            if not os.path.isdir(cache_dir()):
+                os.makedirs(cache_dir())
+            # write and rename, so concurrent runs never read partial files
+            fd, tmp = tempfile.mkstemp(dir=cache_dir(), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as fp:
+                fp.write(doc)
+            os.rename(tmp, path)
+            tmp = None
+        except (IOError, OSError) as e:
+            log.warning("Could not cache template: %s", e)
+        finally:
+            if tmp is not None:
+                try:
+                    os.unlink(tmp)
+                except OSError:
+                    pass
+    return doc.decode('utf-8')
+
+
+def main(preproc=True, stream=False, level=None, cache=True):
     zipin = zipfile.ZipFile(sys.argv[1])
 
     if preproc:
-        doc = preprocess(zipin.open('word/document.xml'), debug=True)
+        doc = preprocessed(zipin, debug=True, cache=cache)
     else:
         doc = zipin.read('word/document.xml').decode('utf-8')
 
-    processed_doc = render(doc, json.load(sys.stdin))
-
-    print(processed_doc)
+    context = json.load(sys.stdin)
+    if not stream:
+        processed_doc = render(doc, context)
+        print(processed_doc)
 
     target = 'Processed_' + sys.argv[1]
-    outzip = zipfile.ZipFile(target, "w")
-    for fileinfo in zipin.infolist():
-        if fileinfo.filename != 'word/document.xml':
-            outzip.writestr(fileinfo, zipin.read(fileinfo))
-        else:
-            outzip.writestr('word/document.xml', processed_doc)
+    with PackageWriter(target, sys.argv[1], level) as writer:
+        for fileinfo in zipin.infolist():
+            if fileinfo.filename != 'word/document.xml':
+                writer.copy(fileinfo.filename)
+            elif stream:
+                with writer.open(fileinfo.filename) as fp:
+                    render_stream(doc, context, fp)
+            else:
+                writer.write('word/document.xml', processed_doc)
+
+
+# state of a batch worker process, set up once by _init_batch
+_batch = {}
+
+
+def _init_batch(path, doc, level):
+    with open(path, 'rb') as fp:
+        _batch['source'] = fp.read()
+    _batch['names'] = [name for name in zipfile.ZipFile(BytesIO(_batch['source'])).namelist()
+                       if name != 'word/document.xml']
+    _batch['template'] = compile_template(doc)
+    _batch['level'] = level
+
+
+def _render_batch(context, target):
+    start = time.time()
+    processed_doc = render(None, context, template=_batch['template'])
+    # documents are rendered in parallel already, compress in this thread
+    with PackageWriter(target, BytesIO(_batch['source']), _batch['level'], workers=1) as writer:
+        for name in _batch['names']:
+            writer.copy(name)
+        writer.write('word/document.xml', processed_doc)
+    return time.time() - start
+
+
+def batch(path, lines, output=None, workers=None, preproc=True, level=None, cache=True):
+    """
+    Render the template at *path* once for every JSON context in *lines*.
+    The template is preprocessed once and compiled once per worker process;
+    document *n* (counted from 1) is written to ``output.format(n=n)`` with
+    compression *level* (0 stores it).
+
+    Returns (rendered, errors), errors being a list of (line number, message).
+    """
+    from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+    if output is None:
+        output = 'Processed_{n}_' + os.path.basename(path)
+    workers = workers or os.cpu_count() or 1
+
+    zipin = zipfile.ZipFile(path)
+    if preproc:
+        doc = preprocessed(zipin, cache=cache)
+    else:
+        doc = zipin.read('word/document.xml').decode('utf-8')
+    zipin.close()
+
+    rendered = 0
+    errors = []
+    pending = {}
+
+    def collect(done):
+        count = 0
+        for future in done:
+            n = pending.pop(future)
+            try:
+                log.debug("Document %d rendered in %.3fs", n, future.result())
+                count += 1
+            except Exception as e:
+                errors.append((n, '%s: %s' % (type(e).__name__, e)))
+        return count
+
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_batch, initargs=(path, doc, level)) as pool:
+        for n, line in enumerate(lines, 1):
+            if not line.strip():
+                continue
+            try:
+                context = json.loads(line)
+            except ValueError as e:
+                errors.append((n, 'invalid JSON: %s' % e))
+                continue
+
+            # keep the number of queued contexts bounded
+            if len(pending) >= 2 * workers:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                rendered += collect(done)
+            pending[pool.submit(_render_batch, context, output.format(n=n))] = n
+
+        rendered += collect(list(pending))
+
+    return rendered, errors
+
+
+def main_batch(argv=None):
+    parser = argparse.ArgumentParser(description='Render a template for every JSON line read from stdin')
+    parser.add_argument('--batch', action='store_true', required=True)
+    parser.add_argument('template')
+    parser.add_argument('-o', '--output', default=None,
+                        help='output path, {n} is replaced by the line number')
+    parser.add_argument('-j', '--workers', type=int, default=None)
+    parser.add_argument('--no-preprocess', dest='preproc', action='store_false')
+    parser.add_argument('--no-cache', dest='cache', action='store_false',
+                        help='always preprocess the template')
+    parser.add_argument('--level', type=int, default=None,
+                        help='compression level of document.xml, 0 stores it')
+    args = parser.parse_args(argv)
+
+    start = time.time()
+    rendered, errors = batch(args.template, sys.stdin, args.output, args.workers, args.preproc, args.level, args.cache)
+    elapsed = time.time() - start
+
+    print('%d documents rendered in %.2fs (%.1f docs/s), %d failed' % (
+        rendered, elapsed, rendered / elapsed if elapsed else 0, len(errors)), file=sys.stderr)
+    for n, message in errors:
+        print('  line %d: %s' % (n, message), file=sys.stderr)
+    return 1 if errors else 0
 
 
 if __name__ == '__main__':
+    if '--batch' in sys.argv:
+        logging.basicConfig(level='WARNING')
+        sys.exit(main_batch())
     logging.basicConfig(level='DEBUG')
     main()
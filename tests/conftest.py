@@ -0,0 +1,8 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+import os
+import sys
+
+# template.py and preprocess.py are scripts in the repository root
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,53 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+from io import BytesIO
+
+from docx import Document
+from docx.oxml import OxmlElement
+from docx.oxml.ns import qn
+
+
+__author__ = 'bluec0re'
+
+
+# noinspection PyProtectedMember
+def add_field(paragraph, instr):
+    def run(child):
+        r = OxmlElement('w:r')
+        r.append(child)
+        paragraph._p.append(r)
+
+    instr_text = OxmlElement('w:instrText')
+    instr_text.text = instr
+    default = OxmlElement('w:t')
+    default.text = '«%s»' % instr
+    run(OxmlElement('w:fldChar', attrs={qn('w:fldCharType'): 'begin'}))
+    run(instr_text)
+    run(OxmlElement('w:fldChar', attrs={qn('w:fldCharType'): 'separate'}))
+    run(default)
+    run(OxmlElement('w:fldChar', attrs={qn('w:fldCharType'): 'end'}))
+
+
+def velocity_document(lines):
+    """
+    Document with a paragraph per line, lines starting with ``$`` or ``#``
+    become merge fields.
+    """
+    doc = Document()
+    for line in lines:
+        if line.startswith(('$', '#')):
+            add_field(doc.add_paragraph(), ' MERGEFIELD "%s" ' % line)
+        else:
+            doc.add_paragraph(line)
+
+    # reload, so the fields are found like in a saved template
+    io = BytesIO()
+    doc.save(io)
+    io.seek(0)
+    return Document(io)
+
+
+# noinspection PyProtectedMember
+def paragraph_texts(doc):
+    return [''.join(t.text or '' for t in p.iter(qn('w:t'))) for p in doc._document_part._element.body.iter(qn('w:p'))]
@@ -0,0 +1,38 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+import asyncio
+import os
+import zipfile
+
+from PIL import Image
+
+from docx_ext.fields import registered_image_factories
+from docx_ext.aio import AsyncRenderer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+__author__ = 'bluec0re'
+
+
+def test_prefetched_images(tmpdir):
+    fetched = []
+
+    async def factory(src):
+        fetched.append(src)
+        return Image.open(os.path.join(ROOT, src))
+
+    context = {
+        'items': [{'name': 'Item A', 'description': '<p>An image: <img src="lena.png"></p>'}],
+        'author': 'Me',
+        'logo': None,
+    }
+    target = str(tmpdir.join('out.docx'))
+    before = registered_image_factories()
+
+    asyncio.run(AsyncRenderer(image_factories=[factory]).render(os.path.join(ROOT, 'HelloField.docx'),
+                                                                context, target))
+
+    assert fetched == ['lena.png']
+    assert registered_image_factories() == before
+    assert any(name.startswith('word/media/') for name in zipfile.ZipFile(target).namelist())
@@ -0,0 +1,70 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+import json
+import os
+import threading
+from http.client import HTTPConnection
+
+import pytest
+
+from docx_ext.daemon import RenderDaemon
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+__author__ = 'bluec0re'
+
+
+@pytest.fixture
+def daemon(tmpdir):
+    daemon = RenderDaemon(port=0, workers=1, templates=ROOT, output=str(tmpdir))
+    yield daemon
+    daemon.server.server_close()
+    daemon.pool.shutdown()
+
+
+def test_render(daemon, tmpdir):
+    daemon.render('HelloField.docx', {'items': [{'name': 'A'}], 'author': 'Me'}, 'out.docx')
+    assert tmpdir.join('out.docx').check()
+
+
+@pytest.mark.parametrize('template, target', [
+    ('../HelloField.docx', 'out.docx'),
+    ('/etc/passwd', 'out.docx'),
+    ('HelloField.docx', '../out.docx'),
+    ('HelloField.docx', '/tmp/out.docx'),
+])
+def test_reject_outside_paths(daemon, template, target):
+    with pytest.raises(PermissionError):
+        daemon.render(template, {}, target)
+    assert daemon.metrics.snapshot()['completed'] == 0
+
+
+def post(daemon, body, content_type):
+    thread = threading.Thread(target=daemon.server.handle_request)
+    thread.start()
+    connection = HTTPConnection(*daemon.server.server_address[:2])
+    connection.request('POST', '/render', json.dumps(body), {'Content-Type': content_type})
+    response = connection.getresponse()
+    result = response.status, json.loads(response.read().decode('utf-8'))
+    connection.close()
+    thread.join()
+    return result
+
+
+def test_post(daemon, tmpdir):
+    status, result = post(daemon, {'template': 'HelloField.docx', 'context': {'author': 'Me'}, 'target': 'out.docx'},
+                          'application/json; charset=utf-8')
+    assert status == 200 and result['target'] == 'out.docx'
+    assert tmpdir.join('out.docx').check()
+
+
+def test_post_outside(daemon):
+    status, _ = post(daemon, {'template': '../x.docx', 'context': {}, 'target': 'out.docx'}, 'application/json')
+    assert status == 403
+
+
+def test_post_plain_text(daemon, tmpdir):
+    status, _ = post(daemon, {'template': 'HelloField.docx', 'context': {}, 'target': 'out.docx'}, 'text/plain')
+    assert status == 415
+    assert not tmpdir.join('out.docx').check()
@@ -0,0 +1,86 @@
+# encoding: utf-8
+"""
+The entry points run in fresh interpreters, without docx_ext.init() called
+before.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import os
+import subprocess
+import sys
+import textwrap
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+__author__ = 'bluec0re'
+
+
+def run(code):
+    # a deadlock fails the test instead of hanging it
+    result = subprocess.run([sys.executable, '-c', textwrap.dedent(code)], cwd=ROOT, timeout=60,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    assert result.returncode == 0, result.stderr
+    return result.stdout
+
+
+def test_lazy_import():
+    assert run("""
+        import sys
+        import docx_ext
+        print('docx' in sys.modules)
+    """).strip() == 'False'
+
+
+def test_init():
+    assert run("""
+        import sys
+        import docx_ext
+        docx_ext.init()
+        docx_ext.init()
+        print('docx' in sys.modules)
+    """).strip() == 'True'
+
+
+def test_save_streaming():
+    assert run("""
+        from io import BytesIO
+        from docx import Document
+        from docx_ext.stream import save_streaming
+        save_streaming(Document('HelloField.docx'), {'items': [{'name': 'A'}], 'author': 'Me'}, BytesIO())
+        print('ok')
+    """).strip() == 'ok'
+
+
+def test_render_sharded():
+    assert run("""
+        from io import BytesIO
+        from docx import Document
+        from docx_ext.shard import render_sharded
+        render_sharded(Document('HelloField.docx'), {'items': [{'name': 'A'}], 'author': 'Me'}, BytesIO())
+        print('ok')
+    """).strip() == 'ok'
+
+
+def test_incremental_render():
+    assert run("""
+        from docx import Document
+        from docx_ext.incremental import IncrementalRender
+        IncrementalRender(Document('HelloField.docx'), {'items': [], 'author': 'Me'}).render()
+        print('ok')
+    """).strip() == 'ok'
+
+
+def test_schema_main():
+    assert 'items (iterable)' in subprocess.check_output(
+        [sys.executable, '-m', 'docx_ext.schema', '--paths', 'HelloField.docx'], cwd=ROOT,
+        universal_newlines=True)
+
+
+def test_specialized_template():
+    assert run("""
+        from io import BytesIO
+        from docx_ext.specialize import SpecializedTemplate
+        template = SpecializedTemplate('HelloField.docx', {'author': 'Me'})
+        template.render({'items': [{'name': 'A', 'description': 'B'}]}, BytesIO())
+        print('ok')
+    """).strip() == 'ok'
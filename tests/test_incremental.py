@@ -0,0 +1,45 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+import pytest
+
+from docx_ext.incremental import IncrementalRender
+
+from helpers import paragraph_texts, velocity_document
+
+
+__author__ = 'bluec0re'
+
+
+def loop_render(items):
+    doc = velocity_document(['$author', '#foreach($i in $items)', '$i.name', '#end'])
+    incremental = IncrementalRender(doc, {'author': 'Me', 'items': items})
+    incremental.render()
+    return doc, incremental
+
+
+def test_update_list_item():
+    doc, incremental = loop_render([{'name': 'A'}, {'name': 'B'}])
+    assert incremental.update({'items.1.name': 'C'}) == 1
+    assert paragraph_texts(doc) == ['Me', 'A', 'C']
+
+
+def test_update_tuple_item():
+    doc, incremental = loop_render(({'name': 'A'}, 'B'))
+    incremental.update({'items.1': {'name': 'C'}})
+    assert paragraph_texts(doc) == ['Me', 'A', 'C']
+
+
+@pytest.mark.parametrize('path', ['items.2.name', 'items.first.name', 'author.name'])
+def test_update_invalid_path(path):
+    doc, incremental = loop_render([{'name': 'A'}, {'name': 'B'}])
+    with pytest.raises(KeyError, match=path):
+        incremental.update({path: 'C'})
+
+
+def test_generator_source():
+    doc, incremental = loop_render({'name': name} for name in 'AB')
+    incremental.render()
+    assert paragraph_texts(doc) == ['Me', 'A', 'B']
+    incremental.update({'items.1.name': 'C'})
+    assert paragraph_texts(doc) == ['Me', 'A', 'C']
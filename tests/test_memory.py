@@ -0,0 +1,64 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+import os
+import threading
+from io import BytesIO
+
+import pytest
+
+from docx_ext.memory import MemoryProfile, stage
+from docx_ext.render import render
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+__author__ = 'bluec0re'
+
+
+def test_render_stages():
+    with MemoryProfile(interval=0) as profile:
+        render(os.path.join(ROOT, 'HelloField.docx'), {'author': 'Me', 'items': []}, BytesIO())
+
+    for name in ('load', 'gen_tree', 'save'):
+        assert profile.stages[name].count == 1
+    assert 'gen_tree' in profile.report()
+
+
+def test_nested_peak():
+    with MemoryProfile(interval=0) as profile:
+        with stage('outer'):
+            with stage('inner'):
+                data = bytearray(4 * 1024 * 1024)
+                del data
+
+    assert profile.stages['outer/inner'].peak >= 4 * 1024 * 1024
+    assert profile.stages['outer'].peak >= 4 * 1024 * 1024
+    assert profile.stages['outer'].retained < 1024 * 1024
+
+
+def test_threads():
+    barrier = threading.Barrier(2)
+
+    def run(name):
+        with stage(name):
+            barrier.wait()
+            with stage('inner'):
+                barrier.wait()
+            barrier.wait()
+
+    with MemoryProfile(interval=0) as profile:
+        threads = [threading.Thread(target=run, args=(name,)) for name in ('a', 'b')]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+    assert sorted(profile.stages) == ['a', 'a/inner', 'b', 'b/inner']
+    assert all(stats.count == 1 for stats in profile.stages.values())
+
+
+def test_single_profile():
+    with MemoryProfile(interval=0):
+        with pytest.raises(RuntimeError):
+            with MemoryProfile(interval=0):
+                pass
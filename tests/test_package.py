@@ -0,0 +1,36 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+import os
+import zipfile
+
+import pytest
+
+from docx_ext.package import PackageWriter
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE = os.path.join(ROOT, 'HelloField.docx')
+
+__author__ = 'bluec0re'
+
+
+def test_open_keeps_member_order(tmpdir):
+    target = str(tmpdir.join('out.docx'))
+    names = zipfile.ZipFile(TEMPLATE).namelist()
+    with PackageWriter(target, TEMPLATE) as writer:
+        for name in names:
+            if name != 'word/document.xml':
+                writer.copy(name)
+            else:
+                with writer.open(name) as fp:
+                    fp.write(zipfile.ZipFile(TEMPLATE).read(name))
+
+    package = zipfile.ZipFile(target)
+    assert package.testzip() is None
+    assert package.namelist() == names
+
+
+def test_copy_without_source(tmpdir):
+    with PackageWriter(str(tmpdir.join('out.docx')), str(tmpdir.join('missing.docx'))) as writer:
+        with pytest.raises(ValueError, match='word/document.xml'):
+            writer.copy('word/document.xml')
@@ -0,0 +1,113 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+from copy import deepcopy
+
+import pytest
+from docx.oxml.ns import qn
+
+from docx_ext.parser import Columns, Context, Provider, gen_tree
+
+from helpers import paragraph_texts, velocity_document
+
+
+__author__ = 'bluec0re'
+
+
+def render(lines, variables):
+    doc = velocity_document(lines)
+    gen_tree(doc).evaluate(Context(variables))
+    return paragraph_texts(doc)
+
+
+def test_if_in_loop():
+    items = [{'name': 'A', 'show': True}, {'name': 'B', 'show': False}, {'name': 'C', 'show': True}]
+    assert render(['head', '#foreach($i in $items)', '#if($i.show)', '$i.name', '#end', '#end', 'tail'],
+                  {'items': items}) == ['head', 'A', 'C', 'tail']
+
+
+def test_nested_loop():
+    groups = [{'name': 'G1', 'items': ['a', 'b']}, {'name': 'G2', 'items': ['c']}]
+    assert render(['head', '#foreach($g in $groups)', '$g.name', '#foreach($i in $g.items)', '$i', '#end', '#end',
+                   'tail'], {'groups': groups}) == ['head', 'G1', 'a', 'b', 'G2', 'c', 'tail']
+
+
+def test_if_in_nested_loop():
+    groups = [{'name': 'G1', 'items': [{'name': 'a', 'show': True}, {'name': 'b', 'show': False}]},
+              {'name': 'G2', 'items': [{'name': 'c', 'show': True}, {'name': 'd', 'show': True}]}]
+    assert render(['head', '#foreach($g in $groups)', '$g.name', '#foreach($i in $g.items)', '#if($i.show)',
+                   '$i.name', '#end', '#end', '#end', 'tail'],
+                  {'groups': groups}) == ['head', 'G1', 'a', 'G2', 'c', 'd', 'tail']
+
+
+def test_content_range_follows_changes():
+    doc = velocity_document(['#if($show)', 'a', 'b', '#end'])
+    node = gen_tree(doc).childs[0]
+    a, b = node.content()
+
+    a.addnext(deepcopy(a))
+    assert len(node.content()) == 3
+
+    node.content()[1].getparent().remove(b)
+    assert len(node.content()) == 2
+
+
+def test_content_range_not_shared_with_clone():
+    doc = velocity_document(['#if($show)', 'a', '#end'])
+    node = gen_tree(doc).childs[0]
+    node.content()
+    assert deepcopy(node)._content is None
+
+
+def test_columns():
+    assert render(['#foreach($r in $rows)', '$r.name', '$r.size', '#end'],
+                  {'rows': Columns({'name': ['a', 'b'], 'size': [1, 2]})}) == ['a', '1', 'b', '2']
+
+
+def test_dict_is_not_columnar():
+    # a plain dict is looped over like any other iterable, by its keys
+    assert render(['#foreach($k in $rows)', '$k', '#end'],
+                  {'rows': {'name': ['a', 'b'], 'size': ['1', '2']}}) == ['name', 'size']
+
+
+def test_provider():
+    calls = []
+
+    def fetch():
+        calls.append(1)
+        return 'fetched'
+
+    context = Context({'used': Provider(fetch, 'used'), 'unused': Provider(fetch)})
+    doc = velocity_document(['$used', '$used'])
+    gen_tree(doc).evaluate(context)
+    assert paragraph_texts(doc) == ['fetched', 'fetched']
+    assert calls == [1]
+    assert context.unused_providers() == ['unused']
+
+
+def test_plain_callable_is_not_called():
+    calls = []
+    context = Context({'func': lambda: calls.append(1)})
+    assert callable(context.resolve('func'))
+    assert calls == []
+
+
+def test_generator_in_if():
+    with pytest.raises(ValueError, match='items'):
+        render(['#if($items)', 'some', '#end'], {'items': (i for i in [])})
+
+
+def test_generator_in_loop():
+    assert render(['#foreach($i in $items)', '$i', '#end'], {'items': (i for i in 'ab')}) == ['a', 'b']
+
+
+def test_normalize_opt_in():
+    doc = velocity_document(['$author', 'split'])
+    doc.paragraphs[1].add_run(' text')
+    body = doc._document_part._element.body
+    runs = len(list(body.iter(qn('w:r'))))
+
+    gen_tree(doc)
+    assert len(list(body.iter(qn('w:r')))) == runs
+    gen_tree(doc, normalize=True)
+    assert len(list(body.iter(qn('w:r')))) < runs
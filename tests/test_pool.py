@@ -0,0 +1,94 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+import os
+import zipfile
+
+from PIL import Image
+from docx import Document
+from lxml import etree
+
+from docx_ext.pool import TemplatePool
+from docx_ext.render import render
+from docx_ext.session import Session
+
+from helpers import add_field
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TEMPLATE = os.path.join(ROOT, 'HelloField.docx')
+
+__author__ = 'bluec0re'
+
+
+def context():
+    return {
+        'items': [
+            {'name': 'Item A', 'description': 'Its just item A'},
+            {'name': 'Item B', 'description': '<p>An image: <img src="lena.png"> and <b>bold</b></p>'},
+        ],
+        'author': 'Me',
+        'logo': Image.open(os.path.join(ROOT, 'lena.png')),
+    }
+
+
+def session():
+    return Session([lambda path: Image.open(os.path.join(ROOT, path))])
+
+
+def document(path):
+    return zipfile.ZipFile(path).read('word/document.xml')
+
+
+def test_pooled_tree(tmpdir):
+    expected = str(tmpdir.join('expected.docx'))
+    render(TEMPLATE, context(), expected, session=session(), normalize=True)
+
+    pool = TemplatePool()
+    for n in range(2):
+        target = str(tmpdir.join('pooled_%d.docx' % n))
+        doc, tree = pool.get_tree(TEMPLATE)
+        render(doc, context(), target, session=session(), tree=tree)
+        assert document(target) == document(expected)
+
+
+def test_pooled_tree_table(tmpdir):
+    doc = Document()
+    doc.add_paragraph('head')
+    table = doc.add_table(rows=3, cols=2)
+    add_field(table.cell(0, 0).paragraphs[0], ' MERGEFIELD "#foreach($i in $items)" ')
+    add_field(table.cell(1, 0).paragraphs[0], ' MERGEFIELD "$i.name" ')
+    add_field(table.cell(1, 1).paragraphs[0], ' MERGEFIELD "$i.value" ')
+    add_field(table.cell(2, 0).paragraphs[0], ' MERGEFIELD "#end" ')
+    add_field(doc.add_paragraph(), ' MERGEFIELD "$author" ')
+    path = str(tmpdir.join('table.docx'))
+    doc.save(path)
+
+    variables = {'items': [{'name': 'A', 'value': '1'}, {'name': 'B', 'value': '2'}], 'author': 'Me'}
+    expected = str(tmpdir.join('expected.docx'))
+    render(path, dict(variables), expected, normalize=True)
+
+    target = str(tmpdir.join('pooled.docx'))
+    doc, tree = TemplatePool().get_tree(path)
+    render(doc, dict(variables), target, tree=tree)
+    assert document(target) == document(expected)
+    assert b'>B<' in document(target)
+
+
+# noinspection PyProtectedMember
+def test_pooled_master_unchanged(tmpdir):
+    pool = TemplatePool()
+    master = pool._load(TEMPLATE)[2]._document_part._element
+    before = etree.tostring(master)
+
+    targets = []
+    for n, author in enumerate(['First', 'Second']):
+        target = str(tmpdir.join('pooled_%d.docx' % n))
+        variables = dict(context(), author=author)
+        variables['items'] = variables['items'][:n + 1]
+        doc, tree = pool.get_tree(TEMPLATE)
+        render(doc, variables, target, session=session(), tree=tree)
+        targets.append(document(target))
+
+    assert etree.tostring(master) == before
+    assert b'First' in targets[0] and b'Second' not in targets[0]
+    assert b'Second' in targets[1] and b'Item B' in targets[1] and b'Item B' not in targets[0]
@@ -0,0 +1,51 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+from docx_ext.parser import Columns, Provider, gen_tree
+from docx_ext.schema import analyze
+
+from helpers import velocity_document
+
+
+__author__ = 'bluec0re'
+
+
+def schema(lines):
+    return analyze(gen_tree(velocity_document(lines)))
+
+
+def test_paths():
+    result = schema(['$author', '#foreach($i in $items)', '#if($i.show)', '$i.name', '#end', '#end'])
+    assert result.paths() == ['author', 'items', 'items[].name', 'items[].show']
+    assert result.iterables() == ['items']
+    assert result.as_dict() == {'author': None, 'items': [{'name': None, 'show': None}]}
+
+
+def test_prune_unused():
+    result = schema(['$author.name', '#foreach($i in $items)', '$i.name', '#end'])
+    variables = {'author': {'name': 'Me', 'mail': 'x'}, 'items': [{'name': 'A', 'blob': 'x'}], 'unused': 1}
+    assert result.prune(variables) == {'author': {'name': 'Me'}, 'items': [{'name': 'A'}]}
+
+
+def test_prune_keeps_values_used_whole():
+    result = schema(['$author', '$author.name', '#foreach($i in $items)', '$i', '$i.name', '#end'])
+    variables = {'author': {'name': 'Me', 'mail': 'x'}, 'items': [{'name': 'A', 'blob': 'x'}]}
+    assert result.prune(variables) == variables
+
+
+def test_prune_keeps_tested_values():
+    result = schema(['#if($author)', '$author.name', '#end'])
+    assert result.prune({'author': {'mail': 'x'}}) == {'author': {'mail': 'x'}}
+
+
+def test_prune_columns():
+    result = schema(['#foreach($i in $items)', '$i.name', '#end'])
+    pruned = result.prune({'items': Columns({'name': ['A'], 'blob': ['x']})})['items']
+    assert isinstance(pruned, Columns)
+    assert pruned.columns == {'name': ['A']}
+
+
+def test_prune_keeps_providers():
+    provider = Provider(lambda: {'name': 'Me', 'mail': 'x'})
+    result = schema(['$author.name'])
+    assert result.prune({'author': provider})['author'] is provider
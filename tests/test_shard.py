@@ -0,0 +1,59 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+from io import BytesIO
+
+import pytest
+from docx import Document
+
+from docx_ext.parser import Columns, Context, gen_tree
+from docx_ext.shard import render_sharded
+
+from helpers import add_field, paragraph_texts
+
+
+__author__ = 'bluec0re'
+
+
+def in_memory_document():
+    # never saved, its source is python-docx's default template
+    doc = Document()
+    add_field(doc.add_paragraph(), ' MERGEFIELD "$author" ')
+    add_field(doc.add_paragraph(), ' MERGEFIELD "#foreach($i in $items)" ')
+    add_field(doc.add_paragraph(), ' MERGEFIELD "$i.name" ')
+    add_field(doc.add_paragraph(), ' MERGEFIELD "#end" ')
+    doc.add_paragraph('tail')
+    return doc
+
+
+def variables(description=''):
+    return {'author': 'Me', 'items': [{'name': 'Item %d%s' % (n, description)} for n in range(7)]}
+
+
+def test_in_memory_document():
+    expected = in_memory_document()
+    gen_tree(expected).evaluate(Context(variables()))
+
+    target = BytesIO()
+    render_sharded(in_memory_document(), variables(), target, chunk_size=2, workers=2)
+    target.seek(0)
+    assert paragraph_texts(Document(target)) == paragraph_texts(expected)
+    assert len(paragraph_texts(expected)) == 9
+
+
+def test_allowed_styles():
+    with pytest.raises(ValueError, match='Title'):
+        render_sharded(in_memory_document(), variables('<p>a</p><p class="Title">x</p>'), BytesIO(), chunk_size=2,
+                       workers=1, allowed_styles=['Normal'])
+
+
+def test_columns():
+    items = Columns({'name': ['Item %d' % n for n in range(7)]})
+    expected = in_memory_document()
+    gen_tree(expected).evaluate(Context({'author': 'Me', 'items': items}))
+
+    target = BytesIO()
+    render_sharded(in_memory_document(), {'author': 'Me', 'items': items}, target, chunk_size=2, workers=2)
+    target.seek(0)
+    assert paragraph_texts(Document(target)) == paragraph_texts(expected)
+    assert len(paragraph_texts(expected)) == 9
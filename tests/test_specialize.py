@@ -0,0 +1,52 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+import zipfile
+from io import BytesIO
+
+import pytest
+
+from docx_ext.parser import Node
+from docx_ext.render import render
+from docx_ext.specialize import SpecializedTemplate
+
+from helpers import velocity_document
+
+
+__author__ = 'bluec0re'
+
+LINES = ['$author', '#if($draft)', 'draft', '#end', '#foreach($i in $items)', '$i.name', '#if($i.show)', '$title',
+         '#end', '$i.value', '#end', '#if($reviewer)', '$reviewer', '#end']
+
+
+def template():
+    io = BytesIO()
+    velocity_document(LINES).save(io)
+    return io.getvalue()
+
+
+def document(data):
+    return zipfile.ZipFile(BytesIO(data)).read('word/document.xml')
+
+
+@pytest.mark.parametrize('constants', [
+    {'author': 'Me', 'draft': False, 'title': 'T'},
+    {'author': 'Me', 'draft': True, 'items': [{'name': 'A', 'show': True, 'value': '1'}]},
+    {'reviewer': ''},
+])
+def test_equals_full_render(constants):
+    variables = {'author': 'Me', 'draft': False, 'title': 'T', 'reviewer': 'You',
+                 'items': [{'name': 'A', 'show': True, 'value': '1'}, {'name': 'B', 'show': False, 'value': '2'}]}
+    variables.update(constants)
+    context = {key: value for key, value in variables.items() if key not in constants}
+
+    expected = BytesIO()
+    render(BytesIO(template()), dict(variables), expected)
+    target = BytesIO()
+    SpecializedTemplate(BytesIO(template()), constants).render(context, target)
+    assert document(target.getvalue()) == document(expected.getvalue())
+
+
+def test_node_partial():
+    with pytest.raises(NotImplementedError):
+        Node().partial({})
@@ -0,0 +1,98 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+import os
+import re
+import zipfile
+from io import BytesIO
+
+from docx import Document
+from lxml import etree
+
+import template
+from docx_ext import normalize
+from helpers import add_field
+
+
+__author__ = 'bluec0re'
+
+
+def jinja_template(path):
+    doc = Document()
+    add_field(doc.add_paragraph('Author: '), ' MERGEFIELD "{{ author }}" ')
+    add_field(doc.add_paragraph(), ' MERGEFIELD "{% for item in items %}" ')
+    add_field(doc.add_paragraph(), ' MERGEFIELD "{{ item.name }}" ')
+    add_field(doc.add_paragraph(), ' MERGEFIELD "{{ item.description }}" ')
+    add_field(doc.add_paragraph(), ' MERGEFIELD "{% endfor %}" ')
+    doc.save(path)
+
+
+def texts(path):
+    document = zipfile.ZipFile(path).read('word/document.xml').decode('utf-8')
+    return re.findall(r'<w:t(?: [^>]*)?>([^<]*)</w:t>', document)
+
+
+def test_preprocess_html():
+    assert template.preprocess_html({'a': ['plain', ('x & y',)]}) == {'a': ['plain', ('x &amp; y',)]}
+    assert '<w:b />' in template.preprocess_html('<p>x <strong>y</strong></p>')
+
+
+def test_batch(tmpdir):
+    path = str(tmpdir.join('template.docx'))
+    jinja_template(path)
+    lines = [
+        '{"author": "Me", "items": [{"name": "A", "description": "<p>x <strong>y</strong></p>"}]}',
+        '{"author": "You", "items": [{"name": "B", "description": "plain"}, {"name": "C", "description": ""}]}',
+        'not json',
+    ]
+    output = str(tmpdir.join('out_{n}.docx'))
+
+    rendered, errors = template.batch(path, lines, output, workers=1, cache=False)
+
+    assert rendered == 2
+    assert [n for n, _ in errors] == [3]
+    first = texts(output.format(n=1))
+    assert 'Me' in first and 'A' in first and 'y' in first
+    assert '{{' not in ''.join(first)
+    second = texts(output.format(n=2))
+    assert 'You' in second and 'B' in second and 'C' in second and 'plain' in second
+
+
+def test_render_stream(tmpdir):
+    path = str(tmpdir.join('template.docx'))
+    jinja_template(path)
+    doc = template.preprocessed(zipfile.ZipFile(path), cache=False)
+    context = {'author': 'Me', 'items': [{'name': 'Item %d' % n, 'description': 'text'} for n in range(3)]}
+
+    stream = BytesIO()
+    template.render_stream(doc, dict(context), stream)
+
+    expected = etree.XML(template.render(doc, dict(context)))
+    assert etree.tostring(etree.XML(stream.getvalue())) == etree.tostring(expected)
+
+
+def test_cache_normalize_version(tmpdir, monkeypatch):
+    path = str(tmpdir.join('template.docx'))
+    jinja_template(path)
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir.join('cache')))
+
+    template.preprocessed(zipfile.ZipFile(path))
+    template.preprocessed(zipfile.ZipFile(path))
+    assert len(os.listdir(template.cache_dir())) == 1
+
+    monkeypatch.setattr(normalize, '__version__', normalize.__version__ + '.1')
+    template.preprocessed(zipfile.ZipFile(path))
+    assert len(os.listdir(template.cache_dir())) == 2
+
+
+def test_cache_write_failure(tmpdir, monkeypatch):
+    path = str(tmpdir.join('template.docx'))
+    jinja_template(path)
+    monkeypatch.setenv('XDG_CACHE_HOME', str(tmpdir.join('cache')))
+
+    def rename(src, dst):
+        raise OSError('read-only')
+    monkeypatch.setattr(os, 'rename', rename)
+
+    assert '{{ author }}' in template.preprocessed(zipfile.ZipFile(path))
+    assert os.listdir(template.cache_dir()) == []
@@ -0,0 +1,47 @@
+# encoding: utf-8
+"""
+Renders in parallel threads, every one with its own session and image
+factory, compared with the same renders done one after another.
+"""
+from __future__ import absolute_import, unicode_literals
+
+import os
+import zipfile
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+
+from PIL import Image
+
+from docx_ext.render import render
+from docx_ext.session import Session
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+__author__ = 'bluec0re'
+
+
+def job(n):
+    color = (n * 10 % 256, 255 - n * 10 % 256, 0)
+    logo = Image.new('RGB', (64, 64), color)
+    logo.caption = 'Logo %d' % n
+    session = Session([lambda path: Image.new('RGB', (32, 32), color)])
+    context = {'author': 'Author %d' % n, 'logo': logo,
+               'items': [{'name': 'Item %d.%d' % (n, i),
+                          'description': '<p>Item <b>%d</b> <img src="item.png" alt="Item %d"></p>' % (i, i)}
+                         for i in range(10)]}
+    io = BytesIO()
+    render(os.path.join(ROOT, 'HelloField.docx'), context, io, session=session)
+    package = zipfile.ZipFile(io)
+    return {name: package.read(name) for name in package.namelist()
+            if name == 'word/document.xml' or name.startswith('word/media/')}
+
+
+def test_threads(documents=16, workers=8):
+    expected = [job(n) for n in range(documents)]
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(job, range(documents)))
+
+    for n, (result, single) in enumerate(zip(results, expected)):
+        assert result == single, 'document %d differs' % n
+    # the sessions did not mix up the images
+    assert len(set(r['word/document.xml'] for r in results)) == documents
@@ -0,0 +1,95 @@
+# encoding: utf-8
+from __future__ import absolute_import, unicode_literals
+
+import os
+import random
+import re
+from copy import deepcopy
+
+from lxml import etree
+
+from docx_ext.utils import Location
+
+
+__author__ = 'bluec0re'
+
+
+# the xpath arithmetic loops used before docx_ext.utils.Location, as the
+# reference for the locations
+
+
+def make_relative(path, start):
+    if path == start or start is None:
+        return './'
+    newpath = os.path.relpath(path, start)
+    if newpath.startswith('../'):
+        m = re.search(r'\.\./([^/]+)\[(\d+)\]', newpath)
+        tag = m.group(1)
+        newoffset = int(m.group(2))
+        m = re.search(r'/%s\[(\d+)\]' % re.escape(tag), start)
+        oldoffset = int(m.group(1))
+        return newpath.replace('../%s[%d]' % (tag, newoffset), '../%s[%d]' % (tag, newoffset - oldoffset))
+    return './' + newpath
+
+
+def make_abs(path, root):
+    if path == './':
+        return root
+    if path.startswith('./'):
+        return root + '/' + path[2:]
+    if path.startswith('../'):
+        m = re.search(r'\.\./([^/]+)\[(-?\d+)\]', path)
+        tag = m.group(1)
+        offset = int(m.group(2))
+        path = path.replace(m.group(0), '')
+        while path.startswith('../'):
+            root = root.rsplit('/', 1)[0]
+            path = path[3:]
+        if offset > 0:
+            if tag in root:
+                return root + '/following-sibling::%s[%d]' % (tag, offset) + path
+            return root + '/%s[%d]' % (tag, offset) + path
+        m = re.search(r'%s\[(\d+)\]' % re.escape(tag), root)
+        newoffset = int(m.group(1)) + offset
+        return root.replace(m.group(0), '') + ('%s[%d]' % (tag, newoffset)) + path
+    return root + '/' + path
+
+
+def random_body(rnd):
+    body = etree.Element('body')
+    for _ in range(rnd.randint(3, 8)):
+        p = etree.SubElement(body, 'p')
+        for _ in range(rnd.randint(1, 4)):
+            r = etree.SubElement(p, rnd.choice(('r', 'r', 'hyperlink')))
+            for _ in range(rnd.randint(0, 2)):
+                etree.SubElement(r, rnd.choice(('t', 'tab')))
+    return body
+
+
+def test_location_matches_xpath_arithmetic():
+    rnd = random.Random(42)
+    for _ in range(500):
+        body = random_body(rnd)
+        tree = body.getroottree()
+        first = rnd.randrange(len(body) - 1)
+        elements = list(body)[first:rnd.randint(first + 1, len(body) - 1)]
+        target = rnd.choice([el for element in elements for el in element.iter()])
+
+        # a loop iteration: the body copied in front of the following paragraph
+        copies = [deepcopy(el) for el in elements]
+        for el in copies:
+            body[-1].addprevious(el)
+
+        relative = make_relative(tree.getpath(target), tree.getpath(elements[0]))
+        expected = body.xpath(make_abs(relative, tree.getpath(copies[0])))
+        assert expected == [Location.of(elements, target).resolve(copies)]
+
+
+def test_location_mixed_tags():
+    body = etree.XML('<body><p><r/></p><tbl><tr><tc><p><r/><r/></p></tc></tr></tbl><p/></body>')
+    elements = list(body)[:2]
+    target = body[1][0][0][0][1]
+    copies = [deepcopy(el) for el in elements]
+    location = Location.of(elements, target)
+    assert location == Location(1, (0, 0, 0, 1))
+    assert location.resolve(copies) is copies[1][0][0][0][1]